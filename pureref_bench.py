@@ -0,0 +1,426 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import struct
+import zlib
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from purformat import PurFile, PurEvents, PurPatch, verify
+from purformat.items import PurImage, PurGraphicsImageItem, PurGraphicsTextItem
+import pureref_layout
+
+####################################################################################################
+# Benchmarks, run them with "python pureref_bench.py <benchmark>", see --help for the options
+# suite: synthesizes a board and times PurFile.read, PurFile.write, a read->write round trip and
+#   pureref_gen.generate, and saves the results as JSON to compare commits. Every benchmark runs in its own process,
+#   peakBytes is the peak resident memory of that process (baseBytes before it ran), not measured on Windows
+# read: writes synthetic .pur files of doubling size and times PurFile.read on each of them,
+#   the time per MB should stay roughly the same if reading scales linearly with file size.
+# layout: times every layout in pureref_layout on random aspect ratios and reports the board ratio
+#   and how uneven the rows are
+# items: memory per image and text item after reading a board with many items, and the time to write and read them
+# batch: normalizing heights and moving every item with Python loops versus PurFile.transform_arrays()
+# patch: edits a board in place with PurPatch and checks it reads back the same as the edits saved with PurFile.write,
+#   exits with 1 if it doesn't so it can be run as a regression check
+####################################################################################################
+
+
+def synthetic_png(size: int, seed: int):
+    # A structurally valid PNG with an IDAT chunk of roughly size bytes, no need for Pillow
+    def chunk(typ: bytes, data: bytes):
+        return struct.pack(">I", len(data)) + typ + data + struct.pack(">I", zlib.crc32(typ + data))
+
+    payload = (seed.to_bytes(4, "big") * (size // 4 + 1))[:size]
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", payload) +
+            chunk(b"IEND", b""))
+
+
+def synthetic_board(image_count: int, image_size: int, duplicates: int = 0, text_count: int = 0, text_depth: int = 1):
+    # A PurFile with image_count unique images laid out in a row, duplicates extra transforms of those images
+    # and text_count texts with text_depth levels of children, half of them on images and half on the canvas
+    pur_file = PurFile()
+    for i in range(image_count):
+        pur_image = PurImage()
+        pur_image.pngBinary = synthetic_png(image_size, i)
+        transform = PurGraphicsImageItem()
+        transform.source = "synthetic/" + str(i) + ".png"
+        transform.name = str(i)
+        transform.x = i * 2000.0
+        pur_image.transforms = [transform]
+        pur_file.images.append(pur_image)
+
+    for i in range(duplicates):
+        transform = PurGraphicsImageItem()
+        transform.source = "synthetic/" + str(i % image_count) + ".png"
+        transform.name = "duplicate " + str(i)
+        transform.x, transform.y = (i % image_count) * 2000.0, (i // image_count + 1) * 2000.0
+        pur_file.images[i % image_count].transforms.append(transform)
+
+    for i in range(text_count):
+        text = PurGraphicsTextItem()
+        text.text = "text " + str(i)
+        parent = text
+        for depth in range(text_depth):
+            child = PurGraphicsTextItem()
+            child.text = "child " + str(depth) + " of text " + str(i)
+            parent.textChildren.append(child)
+            parent = child
+
+        if i % 2 and image_count:
+            pur_file.images[i % image_count].transforms[0].textChildren.append(text)
+        else:
+            pur_file.text.append(text)
+    return pur_file
+
+
+def synthetic_image_folder(folder: str, image_count: int, size: int = 1000):
+    # Noisy JPG and PNG photos for pureref_gen.generate, Pillow is only needed for this benchmark
+    from PIL import Image
+    random.seed(0)
+    for i in range(image_count):
+        width, height = random.choice([(size, size * 3 // 4), (size * 3 // 4, size), (size, size)])
+        image = Image.effect_noise((width, height), 64).convert("RGB")
+        image.save(os.path.join(folder, str(i) + (".png" if i % 2 else ".jpg")))
+
+
+def peak_memory():
+    # Peak resident memory of this process in bytes, unlike tracemalloc this includes Pillow's image buffers and
+    # the pages of memory-mapped files. None where it can't be measured (Windows)
+    try:  # Linux, ru_maxrss would include the peak of the parent process from before it was started
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM:"))
+    except (OSError, StopIteration):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Bytes on macOS
+
+
+def measure(function, repeat: int = 3):
+    # Best time of repeat runs and the peak memory of the process, before (baseBytes) and after running them
+    # Run it in a process of its own (see measure_in_process) so the peak belongs to this benchmark alone
+    try:  # Linux can reset the peak to what is in use now, so loading what the benchmark needs doesn't count
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    base = peak_memory()
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+    return {"seconds": seconds, "peakBytes": peak_memory(), "baseBytes": base}
+
+
+def suite_benchmark(name: str, folder: str):
+    # The function the suite times for name, what it needs is loaded here so it is not part of the time
+    board_path = os.path.join(folder, "board.pur")
+    if name == "write":
+        board = PurFile.open(board_path)
+        return lambda: board.write(os.path.join(folder, "write.pur"))
+    if name == "read":
+        return lambda: PurFile.open(board_path)
+    if name == "read lazy":
+        return lambda: PurFile.open(board_path, lazy=True)
+    if name == "round trip":
+        return lambda: PurFile.open(board_path).write(os.path.join(folder, "copy.pur"))
+    if name == "generate":
+        import pureref_gen
+
+        def generate():
+            with redirect_stdout(io.StringIO()):
+                pureref_gen.generate(os.path.join(folder, "images"), os.path.join(folder, "generate.pur"))
+        return generate
+    raise ValueError("Unknown benchmark " + name)
+
+
+def measure_in_process(name: str, folder: str, repeat: int):
+    # Run a suite benchmark in a new Python process, which prints its measurement as JSON
+    command = [sys.executable, os.path.abspath(__file__), "measure", name, folder, "--repeat", str(repeat)]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def measure_benchmark(arguments):
+    print(json.dumps(measure(suite_benchmark(arguments.name, arguments.folder), arguments.repeat)))
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def suite(arguments):
+    config = {
+        "images": arguments.images,
+        "imageSize": arguments.image_size,
+        "duplicates": arguments.duplicates,
+        "texts": arguments.texts,
+        "textDepth": arguments.text_depth,
+        "generateImages": arguments.generate_images,
+        "repeat": arguments.repeat,
+    }
+    results = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        board = synthetic_board(arguments.images, arguments.image_size, arguments.duplicates,
+                                arguments.texts, arguments.text_depth)
+        board.write(os.path.join(folder, "board.pur"))
+        del board
+        names = ["write", "read", "read lazy", "round trip"]
+        if arguments.generate_images:
+            image_folder = os.path.join(folder, "images")
+            os.mkdir(image_folder)
+            synthetic_image_folder(image_folder, arguments.generate_images)
+            names.append("generate")
+
+        for name in names:
+            results[name] = measure_in_process(name, folder, arguments.repeat)
+        results["write"]["fileBytes"] = os.path.getsize(os.path.join(folder, "board.pur"))
+
+    print("benchmark       time (s)   peak memory (MB)")
+    for name, result in results.items():
+        peak = "n/a" if result["peakBytes"] is None else f"{result['peakBytes'] / 1024 / 1024:.1f}"
+        print(f"{name:12s} {result['seconds']:11.4f} {peak:>18s}")
+
+    report = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": config,
+        "results": results,
+    }
+    with open(arguments.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print("Saved to " + arguments.output)
+
+
+def time_read(filepath: str, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        PurFile().read(filepath)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def read_scaling(arguments):
+    print("images       MB    read (s)   s/MB")
+    with tempfile.TemporaryDirectory() as folder:
+        for step in range(arguments.doublings + 1):
+            count = arguments.images * 2 ** step
+            filepath = os.path.join(folder, str(count) + ".pur")
+            synthetic_board(count, arguments.image_size).write(filepath)
+
+            megabytes = os.path.getsize(filepath) / 1024 / 1024
+            seconds = time_read(filepath)
+            print(f"{count:6d} {megabytes:8.1f} {seconds:11.4f} {seconds / megabytes:7.5f}")
+            os.remove(filepath)
+
+
+def layout_benchmark(arguments):
+    random.seed(0)
+    # Mostly landscape and portrait photos, with some panoramas
+    image_count = arguments.images
+    widths = [random.choice([0.66, 0.75, 1.0, 1.33, 1.5]) * random.uniform(0.9, 1.1) for _ in range(image_count)]
+    widths += [random.uniform(2.5, 5.0) for _ in range(image_count // 50)]
+    random.shuffle(widths)
+
+    print("layout       rows   ratio   row spread   time (s)")
+    for name, layout in pureref_layout.layouts.items():
+        start = time.perf_counter()
+        rows = layout(widths, arguments.ratio)
+        seconds = time.perf_counter() - start
+
+        # Board ratio after every row is scaled to width 1, and how much row widths differ before scaling
+        row_widths = []
+        index = 0
+        for length in rows:
+            row_widths.append(sum(widths[index:index + length]))
+            index += length
+        height = sum(1 / row_width for row_width in row_widths)
+        spread = max(row_widths) / min(row_widths)
+        print(f"{name:10s} {len(rows):6d} {1 / height:7.3f} {spread:12.3f} {seconds:10.4f}")
+
+
+def item_memory(arguments):
+    # Read a board of tiny images so nearly all memory is taken by the items
+    with tempfile.TemporaryDirectory() as folder:
+        filepath = os.path.join(folder, "items.pur")
+        write_events = PurEvents()
+        synthetic_board(arguments.images, 16, text_count=arguments.images, text_depth=0).write(filepath, write_events)
+
+        read_events = PurEvents()
+        tracemalloc.start()
+        pur_file = PurFile.open(filepath, events=read_events)
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        read_events = PurEvents()  # Time a second read, without tracemalloc slowing it down
+        PurFile.open(filepath, events=read_events)
+
+    image_bytes = sum(len(image.pngBinary) + sys.getsizeof(image.pngBinary) for image in pur_file.images)
+    item_count = arguments.images * 2
+    print(f"{item_count} items, {(used - image_bytes) / item_count:.0f} bytes per item (without image data)")
+    print(f"items written in {write_events.timings['items']:.4f}s, read in {read_events.timings['items']:.4f}s")
+
+
+def batch_edit(arguments):
+    import purformat.columns  # Imports NumPy, which should not count as loading the arrays
+    pur_file = synthetic_board(arguments.images, 16)
+
+    start = time.perf_counter()
+    transforms = [transform for image in pur_file.images for transform in image.transforms]
+    for transform in transforms:
+        transform.scale_to_height(1000)
+        transform.x += 10.0
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columns = pur_file.transform_arrays()
+    read_seconds = time.perf_counter() - start
+    columns.normalize_heights(500)
+    columns.translate(10.0, 0.0)
+    edit_seconds = time.perf_counter() - start - read_seconds
+    columns.apply()
+    apply_seconds = time.perf_counter() - start - read_seconds - edit_seconds
+
+    print(f"{arguments.images} items, Python loop {loop_seconds:.4f}s")
+    print(f"arrays: load {read_seconds:.4f}s, edit {edit_seconds:.4f}s, apply {apply_seconds:.4f}s")
+
+
+def item_state(item):
+    # Every slot of an item except its ID, which the writer renumbers, with the state of its text children
+    state = []
+    for cls in type(item).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            if slot == "textChildren":
+                state.append([item_state(child) for child in item.textChildren])
+            elif slot != "id":
+                state.append(getattr(item, slot))
+    return state
+
+
+def board_state(pur_file: PurFile):
+    # Everything PurPatch can change, to compare two boards
+    transforms = [item_state(transform) for image in pur_file.images for transform in image.transforms]
+    return (transforms, [item_state(text) for text in pur_file.text], pur_file.canvas, pur_file.zoom,
+            pur_file.xCanvas, pur_file.yCanvas, pur_file.folderLocation)
+
+
+def patch_check(arguments):
+    def move(pur_file: PurFile):  # Same size, only the changed bytes are written
+        for image in pur_file.images:
+            for transform in image.transforms:
+                transform.x += 10.5
+                transform.scale(1.5)
+        pur_file.canvas = [-20000.0, -20000.0, 20000.0, 20000.0]
+
+    def grow(pur_file: PurFile):  # Longer texts and a new one, the file grows
+        for text in pur_file.text:
+            text.text += " with a longer caption"
+        text = PurGraphicsTextItem()
+        text.text = "new text"
+        pur_file.images[0].transforms[0].textChildren.append(text)
+
+    def shrink(pur_file: PurFile):  # Half the texts removed, the file is truncated
+        pur_file.text = pur_file.text[::2]
+        for image in pur_file.images:
+            image.transforms[0].textChildren = []
+
+    failed = False
+    with tempfile.TemporaryDirectory() as folder:
+        patched_path = os.path.join(folder, "patched.pur")
+        expected_path = os.path.join(folder, "expected.pur")
+        board = synthetic_board(arguments.images, 1024, arguments.images // 4, arguments.images, 2)
+        board.write(patched_path)
+        board.write(expected_path)
+
+        for edit in (move, grow, shrink):
+            expected = PurFile.open(expected_path)
+            edit(expected)
+            expected.write(expected_path)
+
+            patch = PurPatch(patched_path, PurEvents())
+            edit(patch.pur_file)
+            start = time.perf_counter()
+            written = patch.save(PurEvents())
+            seconds = time.perf_counter() - start
+
+            patched = PurFile.open(patched_path, events=PurEvents())
+            same_images = [bytes(image.pngBinary) for image in patched.images] == \
+                          [bytes(image.pngBinary) for image in expected.images]
+            errors = verify(patched_path).errors
+            if board_state(patched) != board_state(expected) or not same_images:
+                errors.append("reads back different from PurFile.write")
+            failed = failed or bool(errors)
+            print(f"{edit.__name__:8s} {written:10d} bytes written in {seconds:.4f}s, {os.path.getsize(patched_path)} "
+                  f"bytes {'ok' if not errors else 'FAILED: ' + '; '.join(errors)}")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for purformat and pureref_gen")
+    benchmarks = parser.add_subparsers(dest="benchmark", required=True)
+
+    suite_parser = benchmarks.add_parser("suite", help="time read, write, round trip and generate")
+    suite_parser.add_argument("--images", type=int, default=500, help="unique images in the board")
+    suite_parser.add_argument("--image-size", type=int, default=256 * 1024, help="bytes per image")
+    suite_parser.add_argument("--duplicates", type=int, default=100, help="extra transforms of existing images")
+    suite_parser.add_argument("--texts", type=int, default=100, help="text items, half of them on images")
+    suite_parser.add_argument("--text-depth", type=int, default=2, help="levels of text children per text")
+    suite_parser.add_argument("--generate-images", type=int, default=20, help="images to generate from, 0 to skip")
+    suite_parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the best is kept")
+    suite_parser.add_argument("--output", default="pureref_bench.json", help="JSON file for the results")
+    suite_parser.set_defaults(run=suite)
+
+    read_parser = benchmarks.add_parser("read", help="read time of boards of doubling size")
+    read_parser.add_argument("--images", type=int, default=250, help="images in the smallest board")
+    read_parser.add_argument("--doublings", type=int, default=4, help="how many times the board doubles")
+    read_parser.add_argument("--image-size", type=int, default=64 * 1024, help="bytes per image")
+    read_parser.set_defaults(run=read_scaling)
+
+    layout_parser = benchmarks.add_parser("layout", help="every layout on random aspect ratios")
+    layout_parser.add_argument("--images", type=int, default=100000, help="number of images")
+    layout_parser.add_argument("--ratio", type=float, default=1.0, help="width/height ratio to aim for")
+    layout_parser.set_defaults(run=layout_benchmark)
+
+    items_parser = benchmarks.add_parser("items", help="memory per item")
+    items_parser.add_argument("--images", type=int, default=30000, help="image items, and as many text items")
+    items_parser.set_defaults(run=item_memory)
+
+    batch_parser = benchmarks.add_parser("batch", help="batch edits with NumPy arrays versus loops")
+    batch_parser.add_argument("--images", type=int, default=50000, help="number of image items")
+    batch_parser.set_defaults(run=batch_edit)
+
+    measure_parser = benchmarks.add_parser("measure", help="used by suite to run one benchmark in its own process")
+    measure_parser.add_argument("name", help="benchmark of the suite")
+    measure_parser.add_argument("folder", help="folder with the board and images of the suite")
+    measure_parser.add_argument("--repeat", type=int, default=3, help="runs, the best time is kept")
+    measure_parser.set_defaults(run=measure_benchmark)
+
+    patch_parser = benchmarks.add_parser("patch", help="check and time editing a board in place with PurPatch")
+    patch_parser.add_argument("--images", type=int, default=2000, help="number of images, and as many texts")
+    patch_parser.set_defaults(run=patch_check)
+
+    arguments = parser.parse_args(argv)
+    return arguments.run(arguments)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
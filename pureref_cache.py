@@ -0,0 +1,64 @@
+import os
+import hashlib
+
+####################################################################################################
+# On-disk cache of encoded PNGs for pureref_gen.py and pureref_preview.py,
+# so unchanged images are not encoded or decoded again
+# Entries are keyed by the hash of the source file and the encode settings,
+# and the least recently used entries are removed once the cache grows past max_bytes
+####################################################################################################
+
+
+class PngCache:
+
+    # Only holds the folder and the size cap, so it can be sent to worker processes
+    def __init__(self, folder: str, max_bytes: int = 2 * 1024 ** 3):
+        self.folder = os.path.abspath(folder)
+        self.max_bytes = max_bytes
+        os.makedirs(self.folder, exist_ok=True)
+
+    # Cache key of a source file's content with the settings it is encoded with
+    @staticmethod
+    def key(source: bytes, *settings):
+        digest = hashlib.sha256(source)
+        digest.update(repr(settings).encode())
+        return digest.hexdigest()
+
+    def path(self, key: str):
+        return os.path.join(self.folder, key + ".png")
+
+    # Encoded PNG bytes for key, or None if it is not cached
+    def get(self, key: str):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                png_binary = f.read()
+            os.utime(path)  # Mark as recently used
+            return png_binary
+        except OSError:
+            return None
+
+    def put(self, key: str, png_binary: bytes):
+        # Write to a temporary name first, other processes may be reading or writing the same entry
+        temp_path = self.path(key) + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(png_binary)
+        os.replace(temp_path, self.path(key))
+
+    # Remove the least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith(".png"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # Already removed by another process
+                pass
+            total -= size
@@ -1,9 +1,15 @@
 import purformat.items as items
 from purformat import purformat
+from purformat.events import PurEvents, default_events
 from PIL import Image
+from pureref_cache import PngCache
+import pureref_layout
 import os
 import re
+import struct
 from io import BytesIO
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 ####################################################################################################
 # This function will create a neatly organized .pur (PureRef) file from a folder with PNG or JPG images
@@ -11,37 +17,106 @@ from io import BytesIO
 ####################################################################################################
 
 
-def generate(read_folder, write_file):
-
-    # Natural sort https://stackoverflow.com/a/341745
-    # For example: 0.jpg, 2.jpg, 10.jpg, 100.jpg
-    # Instead of: 0.jpg, 10.jpg, 100.jpg, 2.jpg
-    def natural_keys(text):
-        return [int(c) if c.isdigit() else c for c in re.split(r'(\d+)', text)]
-
-    def process_image(path):
-        if not (path.endswith(".jpg") or path.endswith(".jpeg") or path.endswith(".png")):
-            print("Skipping processing, not a valid image: " + path)
-            return None
-
-        print("Processing: " + path)
-
-        image = Image.open(path).convert(mode="RGB")
-        pur_image = items.PurImage()
-
-        with BytesIO() as f:
-            image.save(f, format="PNG", compress_level=7)  # TODO: research why PureRef saves PNG differently sometimes
-            pur_image.pngBinary = f.getvalue()
-            # bytes are used instead of PIL because the pngBinary can also be a reference to another image's transform
-            # (duplicate images) this is the easiest way to handle it TODO: make PurFile work with PIL images
-
-        pur_transform = items.PurGraphicsImageItem()
-        pur_transform.reset_crop(image.width, image.height)
-        pur_transform.name = path.replace(".jpg", "")
-        pur_transform.source = path
-        pur_image.transforms = [pur_transform]  # the first transform is the original, rest are duplicates
-
-        return pur_image
+# Natural sort https://stackoverflow.com/a/341745
+# For example: 0.jpg, 2.jpg, 10.jpg, 100.jpg
+# Instead of: 0.jpg, 10.jpg, 100.jpg, 2.jpg
+def natural_keys(text):
+    return [int(c) if c.isdigit() else c for c in re.split(r'(\d+)', text)]
+
+
+png_foot = bytes([0, 0, 0, 0, 73, 69, 78, 68, 174, 66, 96, 130])  # IEND chunk, the last bytes of a clean PNG
+
+
+# Turn an image file into a PurImage with one transform, None if it is not a valid image
+# Lives at module level so worker processes can run it
+# RGB(A) PNGs are embedded as they are if passthrough is on, everything else is encoded to PNG using
+# compress_level (0-9, lower is faster) and compress_type (zlib strategy, see Pillow's PNG options)
+# With a PngCache, encoded PNGs are looked up by source content before encoding and stored after
+# max_size caps the longest side of the stored image in pixels, the transform keeps the original size on the canvas
+# Skipped images are reported to events, which are printed by default
+def process_image(path, passthrough=True, compress_level=7, compress_type=-1, cache: PngCache = None,
+                  max_size=None, events: PurEvents = None):
+    events = default_events(events)
+    if not (path.endswith(".jpg") or path.endswith(".jpeg") or path.endswith(".png")):
+        events.message("Skipping processing, not a valid image: " + path, path=path)
+        return None
+
+    pur_image = items.PurImage()
+
+    try:
+        image = Image.open(path)  # Only reads the header, pixels are decoded when needed
+        original_width, original_height = image.size
+
+        stored_size = image.size
+        if max_size and max(image.size) > max_size:
+            scale = max_size / max(image.size)
+            stored_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+
+        png_binary = None
+        if passthrough and image.format == "PNG" and image.mode in ("RGB", "RGBA") and stored_size == image.size:
+            with open(path, "rb") as f:
+                png_binary = f.read()
+            if not png_binary.endswith(png_foot):  # Trailing data after IEND, let Pillow clean it up
+                png_binary = None
+
+        cache_key = None
+        if png_binary is None and cache is not None:
+            with open(path, "rb") as f:
+                cache_key = cache.key(f.read(), compress_level, compress_type, stored_size)
+            png_binary = cache.get(cache_key)
+
+        if png_binary is None:
+            # JPEGs can be decoded at 1/2, 1/4 or 1/8 size directly, so large sources are never fully decoded
+            # Does nothing for other formats
+            image.draft(None, stored_size)
+
+            # Keep transparency, only flatten to RGB when there is no alpha
+            has_alpha = "A" in image.getbands() or "transparency" in image.info
+            image = image.convert(mode="RGBA" if has_alpha else "RGB")
+            if image.size != stored_size:
+                image = image.resize(stored_size, Image.LANCZOS, reducing_gap=3.0)
+
+            with BytesIO() as f:
+                # TODO: research why PureRef saves PNG differently sometimes
+                image.save(f, format="PNG", compress_level=compress_level, compress_type=compress_type)
+                png_binary = f.getvalue()
+
+            if cache_key is not None:
+                cache.put(cache_key, png_binary)
+    except OSError as error:  # Corrupt or truncated, skip it instead of losing the whole board
+        events.message("Skipping processing, could not read image: " + path + " (" + str(error) + ")", path=path)
+        return None
+
+    pur_image.pngBinary = png_binary
+    # bytes are used instead of PIL because the pngBinary can also be a reference to another image's transform
+    # (duplicate images) this is the easiest way to handle it TODO: make PurFile work with PIL images
+
+    # Crop points are in pixels of the stored image, which can be smaller than the original
+    stored_width, stored_height = struct.unpack(">II", png_binary[16:24])  # From the PNG IHDR chunk
+
+    pur_transform = items.PurGraphicsImageItem()
+    pur_transform.reset_crop(stored_width, stored_height)
+    pur_transform.width, pur_transform.height = original_width, original_height  # Same size on the canvas
+    pur_transform.name = path.replace(".jpg", "")
+    pur_transform.source = path
+    pur_image.transforms = [pur_transform]  # the first transform is the original, rest are duplicates
+
+    return pur_image
+
+
+# workers > 1 encodes the images in that many processes, the result is identical to workers=1
+# passthrough, compress_level, compress_type and cache are passed on to process_image
+# deduplicate stores identical images once, with a transform for every file they came from
+# max_size caps the longest side of stored images in pixels, the layout is the same as without it
+# layout is one of pureref_layout.layouts, ratio the width/height of the board it should aim for
+# events is an optional PurEvents that gets the encode, layout and write phases and progress per image,
+# messages are printed if it is not given
+# Returns whether write_file was written, nothing is written if read_folder has no valid images
+def generate(read_folder, write_file, workers=1, passthrough=True, compress_level=7, compress_type=-1,
+             cache: PngCache = None, deduplicate=True, max_size=None, layout="justified", ratio=1.0,
+             events: PurEvents = None):
+
+    events = default_events(events)
 
     # Initialize an empty .pur file which will hold objects for images with transforms(1, n), and text
     pur_file = purformat.PurFile()
@@ -49,59 +124,54 @@ def generate(read_folder, write_file):
     # Add all images in read_folder to pur_file
     # The images will be sorted using natural sort, number them to control order
     files = sorted(os.listdir(read_folder), key=natural_keys)
-    pur_file.images = [process_image(os.path.join(read_folder, file)) for file in files]
-    pur_file.images = [image for image in pur_file.images if image is not None]  # remove None values
+    paths = [os.path.join(read_folder, file) for file in files]
+    process = partial(process_image, passthrough=passthrough, compress_level=compress_level,
+                      compress_type=compress_type, cache=cache, max_size=max_size)
+
+    def collect(results):  # Gather the images in order while reporting progress
+        for done, (path, pur_image) in enumerate(zip(paths, results)):
+            if pur_image is None:  # remove None values, process_image already said why
+                events.progress("encode", done + 1, len(paths), path=path, skipped=True)
+                continue
+            pur_file.images.append(pur_image)
+            counts["bytes"] += len(pur_image.pngBinary)
+            events.progress("encode", done + 1, len(paths), path=path, message="Processing: " + path)
+
+    with events.phase("encode") as counts:
+        counts["bytes"] = 0
+        if workers > 1:
+            # Worker processes print their own messages, events can not be sent between processes
+            with ProcessPoolExecutor(workers) as executor:  # map keeps the sorted order
+                collect(executor.map(process, paths))
+        else:
+            collect(process(path, events=events) for path in paths)
+        counts["images"] = len(pur_file.images)
+
+        if cache is not None:
+            cache.evict()  # Keep the cache under its size cap
 
     if not pur_file.images:
-        print("Skipping, no valid images found in " + read_folder)
-        return
+        events.message("Skipping, no valid images found in " + read_folder)
+        return False
 
-    # Start transforming images to automatically order
+    # Start transforming images to automatically order, in file order even if duplicates are merged below
     transforms = [transform for image in pur_file.images for transform in image.transforms]
 
-    [transform.scale_to_height(1000) for transform in transforms]  # normalize all images to height 1000
-
-    total_width = sum([transform.width for transform in transforms])
-
-    # Divide into rows by cutting in half until it is rectangular enough
-    rows = [transforms]  # Initially one row, list of rows with so far only one list of transforms.
-    # TODO: alternative rectangle algorithm, extract to function with ratio arguments
-    while len(rows)*2000.0 < total_width:  # while more wide than tall, eventually making a decent rectangle
-        total_width /= 2.0
-        new_rows = []
-
-        for row in rows:
-            row_length = total_width
-
-            # get the index of the middle transform by summing widths until it exceeds half of the total width
-            middle_index = 0
-            while row_length > 0:
-                row_length -= row[middle_index].width
-                middle_index += 1
-
-            # split the row in half
-            new_rows.append(row[:middle_index])
-            new_rows.append(row[middle_index:])
-
-        rows = new_rows
-
-    # Normalize row widths and actually place images, this makes everything line up perfectly.
-    placement_y = 0
-
-    # if not empty
-    for row in [row for row in rows if row]:  # deals with empty rows
-        row_width = sum([transform.width for transform in row])
-        scale_factor = 1000/row_width  # the entire row is normalized to 1000 width
-
-        placement_x = 0
-        for transform in row:
-            transform.scale(scale_factor)
+    if deduplicate:
+        duplicates = pur_file.deduplicate()
+        if duplicates:
+            events.message("Merged " + str(duplicates) + " duplicate images", duplicates=duplicates)
 
-            transform.x = placement_x + transform.width / 2
-            placement_x += transform.width
-            transform.y = placement_y + transform.height / 2
+    with events.phase("layout") as counts:
+        [transform.scale_to_height(1000) for transform in transforms]  # normalize all images to height 1000
 
-        placement_y += 1000 * scale_factor  # images are 1000 height and scaled to row width
+        # Divide into rows with the chosen layout, then scale every row to the same width to line everything up
+        rows = pureref_layout.layouts[layout]([transform.width / 1000 for transform in transforms], ratio)
+        pureref_layout.place_rows(transforms, rows)
+        counts["transforms"] = len(transforms)
+        counts["rows"] = len(rows)
 
-    pur_file.write(write_file)
-    print("Done! File created")
+    with events.phase("write"):
+        pur_file.write(write_file, events)
+    events.message("Done! File created")
+    return True
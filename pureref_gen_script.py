@@ -1,47 +1,147 @@
 import os
+import time
+import argparse
 import pureref_gen
-import sys
+import pureref_manifest
+import pureref_layout
+from pureref_cache import PngCache
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 ####################################################################################################
 # Just run this with "python pureref_gen_script.py" in your command line inside the PureRef-format
 # folder. It will generate a folder for input (Artists) and output (Purs) for you.
 # Then you can put folders with images in the Artists folder and run "python pureref_gen_script.py"
 # again to generate the Purs.
+# With "--workers 8" eight boards are built at the same time, largest folders first.
 ####################################################################################################
 
-imagefolder_path = os.getcwd() + "/Artists"  # default input
 
-purfolder_path = os.getcwd() + "/Purs"  # default output
+# Total bytes of the images in a folder, used to start the biggest boards first
+def folder_size(folder):
+    return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
 
-# if you give the script two arguments, it will use these for the imagefolder and purfolder
-if len(sys.argv) > 1:
-    imagefolder_path = os.path.abspath(sys.argv[1])
-    purfolder_path = os.path.abspath(sys.argv[2])
 
-# This is where you put folders with JPG or PNG images, or directly put JPG or PNG images here if there are no folders
-if not os.path.exists(imagefolder_path):
-    os.mkdir(imagefolder_path)
+# Build one board, record its manifest and return how long it took and whether the board has images
+# A folder without valid images gets no board, one left from an earlier run is removed. Runs in a worker process
+def build_board(image_folder, pur_file, passthrough=True, compress_level=7, cache=None, max_size=None,
+                layout="justified", ratio=1.0, compress_type=-1):
+    start = time.perf_counter()
+    # Before generating, so changes during the build are seen next time
+    inputs = pureref_manifest.scan_inputs(image_folder)
+    written = pureref_gen.generate(image_folder, pur_file, passthrough=passthrough, compress_level=compress_level,
+                                   compress_type=compress_type, cache=cache, max_size=max_size, layout=layout,
+                                   ratio=ratio)
+    if not written and os.path.exists(pur_file):
+        os.remove(pur_file)  # So the manifest records the board as empty
+    settings = {"passthrough": passthrough, "compress_level": compress_level, "compress_type": compress_type,
+                "max_size": max_size, "layout": layout, "ratio": ratio}
+    pureref_manifest.write_manifest(pur_file, image_folder, settings, inputs)
+    return time.perf_counter() - start, written
 
-# This is where PureRef files come out
-if not os.path.exists(purfolder_path):
-    os.mkdir(purfolder_path)
 
-folders = next(os.walk(imagefolder_path))[1]  # get all subfolders in imagefolder_path
+def main():
+    parser = argparse.ArgumentParser(description="Generate a .pur file for every folder of images")
+    parser.add_argument("imagefolder", nargs="?", default=os.getcwd() + "/Artists", help="input, default Artists/")
+    parser.add_argument("purfolder", nargs="?", default=os.getcwd() + "/Purs", help="output, default Purs/")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of boards to build at the same time")
+    parser.add_argument("--compress-level", type=int, default=7, help="PNG compression 0-9, lower is faster")
+    parser.add_argument("--compress-type", type=int, default=-1, choices=[-1, 0, 1, 2, 3, 4],
+                        help="zlib strategy for PNGs: 0 default, 1 filtered, 2 Huffman only, 3 RLE, 4 fixed, "
+                             "-1 lets Pillow choose")
+    parser.add_argument("--no-passthrough", action="store_true", help="re-encode PNG files instead of embedding them")
+    parser.add_argument("--max-size", type=int,
+                        help="downscale images so their longest side is at most this many pixels")
+    parser.add_argument("--layout", default="justified", choices=pureref_layout.layouts, help="how to arrange rows")
+    parser.add_argument("--ratio", type=float, default=1.0, help="width/height ratio the boards should have")
+    parser.add_argument("--cache", help="folder to keep encoded images in, so unchanged images are not encoded again")
+    parser.add_argument("--cache-size", type=int, default=2048, help="maximum cache size in MB, default 2048")
+    arguments = parser.parse_args()
 
-# if there are no folders, try to use the root folder since the images might be there instead
-if len(folders) == 0:
-    print("No folders found in " + imagefolder_path + ", using root folder instead")
-    folders = [os.path.basename(imagefolder_path)]  # name of the last directory
-    imagefolder_path = "/".join(imagefolder_path.split("/")[:-1])  # subtract last directory from the path
+    cache = PngCache(arguments.cache, arguments.cache_size * 1024 * 1024) if arguments.cache else None
 
-# Turn all folders with images in imagefolder_path into .pur files in purfolder_path
-# Unless the .pur already exists, if you want to regenerate it, you need to delete the .pur file
-for folder in folders:
-    if not os.path.exists(purfolder_path + "/" + folder + ".pur"):
-        print("Creating " + folder + ".pur")
-        pureref_gen.generate(imagefolder_path + "/" + folder, purfolder_path + "/" + folder + ".pur")
-    else:
-        print("File already exists, skipping " + folder)
+    imagefolder_path = os.path.abspath(arguments.imagefolder)
+    purfolder_path = os.path.abspath(arguments.purfolder)
+
+    # This is where you put folders with JPG or PNG images,
+    # or directly put JPG or PNG images here if there are no folders
+    if not os.path.exists(imagefolder_path):
+        os.mkdir(imagefolder_path)
+
+    # This is where PureRef files come out
+    if not os.path.exists(purfolder_path):
+        os.mkdir(purfolder_path)
+
+    folders = next(os.walk(imagefolder_path))[1]  # get all subfolders in imagefolder_path
+
+    # if there are no folders, try to use the root folder since the images might be there instead
+    if len(folders) == 0:
+        print("No folders found in " + imagefolder_path + ", using root folder instead")
+        folders = [os.path.basename(imagefolder_path)]  # name of the last directory
+        imagefolder_path = os.path.dirname(imagefolder_path)  # subtract last directory from the path
+
+    # Turn all folders with images in imagefolder_path into .pur files in purfolder_path
+    # Boards are only generated again if their images or settings changed since the last time (see pureref_manifest.py)
+    settings = {"passthrough": not arguments.no_passthrough, "compress_level": arguments.compress_level,
+                "compress_type": arguments.compress_type, "max_size": arguments.max_size, "layout": arguments.layout,
+                "ratio": arguments.ratio}
+    jobs = []
+    skipped = []
+    for folder in folders:
+        if pureref_manifest.needs_rebuild(imagefolder_path + "/" + folder, purfolder_path + "/" + folder + ".pur",
+                                          settings):
+            jobs.append(folder)
+        else:
+            print("Up to date, skipping " + folder)
+            skipped.append(folder)
+
+    # Boards generated from folders that no longer exist are removed with their manifest
+    removed = []
+    for pur_file, folder in pureref_manifest.orphaned_boards(purfolder_path):
+        print("Removing " + os.path.basename(pur_file) + ", " + folder + " no longer exists")
+        if os.path.exists(pur_file):
+            os.remove(pur_file)
+        os.remove(pureref_manifest.manifest_path(pur_file))
+        removed.append(os.path.basename(pur_file))
+
+    # Largest folders first, so one huge folder does not keep the last worker busy long after the rest are done
+    jobs.sort(key=lambda job: folder_size(imagefolder_path + "/" + job), reverse=True)
+
+    failed = []
+    empty = []
+    with ProcessPoolExecutor(max(1, arguments.workers)) as executor:
+        futures = {}
+        for folder in jobs:
+            print("Creating " + folder + ".pur")
+            future = executor.submit(build_board, imagefolder_path + "/" + folder,
+                                     purfolder_path + "/" + folder + ".pur", not arguments.no_passthrough,
+                                     arguments.compress_level, cache, arguments.max_size, arguments.layout,
+                                     arguments.ratio, arguments.compress_type)
+            futures[future] = folder
+
+        for future in as_completed(futures):
+            folder = futures[future]
+            try:
+                seconds, written = future.result()
+            except Exception as error:  # A broken folder should not stop the other boards
+                print(f"Failed to create {folder}.pur: {error!r}")
+                failed.append(folder)
+                continue
+            if written:
+                print(f"Finished {folder}.pur in {seconds:.2f}s")
+            else:
+                print(f"No valid images in {folder}, there is no {folder}.pur")
+                empty.append(folder)
+
+    rebuilt = [folder for folder in jobs if folder not in failed and folder not in empty]
+    print(f"Rebuilt {len(rebuilt)}, skipped {len(skipped)}, removed {len(removed)}, empty {len(empty)}, "
+          f"failed {len(failed)}")
+    for label, names in (("Rebuilt", rebuilt), ("Removed", removed), ("Empty", empty), ("Failed", failed)):
+        if names:
+            print(label + ": " + ", ".join(names))
+
+
+if __name__ == "__main__":
+    main()
 
 # The file will say it has a "load error", just press "Open Anyway (Unsafe)"
 # This is only because the checksum to check for corruption is not generated correctly
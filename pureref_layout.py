@@ -0,0 +1,140 @@
+from typing import List
+
+####################################################################################################
+# Layouts that arrange the images of pureref_gen.py into rows
+# A layout gets the widths of all images scaled to the same height (in order) and the width/height
+# ratio the board should have, and returns how many images go in each row.
+# Rows are then scaled to the same width by place_rows, so every row lines up perfectly.
+# Add your own to layouts to make it available in generate(layout=...)
+####################################################################################################
+
+
+# Number of rows that gives a board of about this ratio, if every row is equally wide
+def row_count(widths: List[float], ratio: float):
+    # Rows of width total / rows at height 1 scaled to width 1 are rows / total high,
+    # so the board is total / rows ** 2 wide for every unit of height
+    return max(1, min(len(widths), round((sum(widths) / ratio) ** 0.5)))
+
+
+# The original layout: cut rows in half until the board is rectangular enough
+# Only gives a power of two rows, and the halves are not always even
+def halving_rows(widths: List[float], ratio: float = 1.0):
+    rows = [widths]
+    total_width = sum(widths)
+    while len(rows) * 2.0 * ratio < total_width:  # while more wide than tall, eventually making a decent rectangle
+        total_width /= 2.0
+        new_rows = []
+
+        for row in rows:
+            row_length = total_width
+
+            # get the index of the middle image by summing widths until it exceeds half of the total width
+            middle_index = 0
+            while row_length > 0 and middle_index < len(row):
+                row_length -= row[middle_index]
+                middle_index += 1
+
+            # split the row in half
+            new_rows.append(row[:middle_index])
+            new_rows.append(row[middle_index:])
+
+        rows = new_rows
+
+    return [len(row) for row in rows if row]
+
+
+# Fast single pass: close a row once it is as wide as it should be, for very large folders
+def greedy_rows(widths: List[float], ratio: float = 1.0):
+    rows_left = row_count(widths, ratio)
+    remaining = sum(widths)
+
+    rows = []
+    row_width, row_length = 0.0, 0
+    for width in widths:
+        target = remaining / rows_left  # Spread what is left evenly over the rows that are left
+        # Start a new row if adding this image overshoots the target more than leaving it out falls short
+        if rows_left > 1 and row_length and row_width + width - target > target - row_width:
+            rows.append(row_length)
+            remaining -= row_width
+            rows_left -= 1
+            row_width, row_length = 0.0, 0
+        row_width += width
+        row_length += 1
+    rows.append(row_length)
+    return rows
+
+
+# Optimal rows: minimizes the squared difference between every row's width and the target width
+# Solved in linear time with the convex hull trick, since the cost of a row is a square of prefix sums
+def justified_rows(widths: List[float], ratio: float = 1.0):
+    target = sum(widths) / row_count(widths, ratio)
+
+    # cost[i] is the lowest cost of putting the first i images in rows, with the last row starting at start[i]
+    # cost[i] = min over j < i of cost[j] + (prefix[i] - prefix[j] - target) ** 2
+    # which is (prefix[i] - target) ** 2 plus the minimum at x = prefix[i] - target of the lines
+    # y = -2 * prefix[j] * x + cost[j] + prefix[j] ** 2. The slopes only go down and x only goes up,
+    # so lines that are never the lowest again can be dropped from both ends
+    count = len(widths)
+    prefix = [0.0] * (count + 1)
+    for i, width in enumerate(widths):
+        prefix[i + 1] = prefix[i] + width
+
+    cost = [0.0] * (count + 1)
+    start = [0] * (count + 1)
+    slopes, intercepts, indices = [0.0], [0.0], [0]  # Lower hull of the lines, starting with j = 0
+    front = 0
+
+    def unnecessary(a, b, c):  # Whether line b is never the lowest when a comes before it and c after
+        return ((intercepts[c] - intercepts[a]) * (slopes[a] - slopes[b]) <=
+                (intercepts[b] - intercepts[a]) * (slopes[a] - slopes[c]))
+
+    for i in range(1, count + 1):
+        x = prefix[i] - target
+        while (front + 1 < len(slopes) and
+               slopes[front + 1] * x + intercepts[front + 1] <= slopes[front] * x + intercepts[front]):
+            front += 1
+        j = indices[front]
+        cost[i] = slopes[front] * x + intercepts[front] + x * x
+        start[i] = j
+
+        # Add the line for a row starting after image i
+        slopes.append(-2.0 * prefix[i])
+        intercepts.append(cost[i] + prefix[i] * prefix[i])
+        indices.append(i)
+        while len(slopes) - front >= 3 and unnecessary(-3, -2, -1):
+            del slopes[-2], intercepts[-2], indices[-2]
+
+    rows = []
+    i = count
+    while i > 0:
+        rows.append(i - start[i])
+        i = start[i]
+    return rows[::-1]
+
+
+layouts = {
+    "halving": halving_rows,
+    "greedy": greedy_rows,
+    "justified": justified_rows,
+}
+
+
+# Place transforms in rows of the given lengths, every row is scaled to the same width
+# The transforms should all be row_height high, which is used as is so rounding in their matrices doesn't add up
+def place_rows(transforms, rows: List[int], row_width=1000.0, row_height=1000.0):
+    placement_y = 0
+    index = 0
+    for length in rows:
+        row = transforms[index:index + length]
+        index += length
+        scale_factor = row_width / sum([transform.width for transform in row])
+
+        placement_x = 0
+        for transform in row:
+            transform.scale(scale_factor)
+
+            transform.x = placement_x + transform.width / 2
+            placement_x += transform.width
+            transform.y = placement_y + transform.height / 2
+
+        placement_y += row_height * scale_factor
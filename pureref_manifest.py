@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+
+####################################################################################################
+# Manifests let pureref_gen_script.py rebuild only the boards whose images changed
+# Every generated Board.pur gets a Board.pur.json next to it, recording the folder it was made from,
+# the generate settings and the size, mtime and hash of every image that went into it
+####################################################################################################
+
+image_extensions = (".jpg", ".jpeg", ".png")  # Same files pureref_gen.process_image accepts
+
+
+def manifest_path(pur_file):
+    return pur_file + ".json"
+
+
+# Size and mtime of every image in a folder, by file name
+def scan_inputs(folder):
+    return {entry.name: {"size": entry.stat().st_size, "mtime": entry.stat().st_mtime_ns}
+            for entry in os.scandir(folder) if entry.is_file() and entry.name.endswith(image_extensions)}
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(pur_file):
+    try:
+        with open(manifest_path(pur_file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Record the images in folder that pur_file was just generated from
+def write_manifest(pur_file, folder, settings, inputs=None):
+    inputs = scan_inputs(folder) if inputs is None else inputs
+    for name, record in inputs.items():
+        record["hash"] = file_hash(os.path.join(folder, name))
+
+    # An empty board is one where no .pur was written because there were no valid images
+    manifest = {"folder": os.path.abspath(folder), "settings": settings, "inputs": inputs,
+                "empty": not os.path.exists(pur_file)}
+    with open(manifest_path(pur_file), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+
+# Whether pur_file has to be generated again from folder
+def needs_rebuild(folder, pur_file, settings):
+    manifest = read_manifest(pur_file)
+    if not os.path.exists(pur_file) and (manifest is None or not manifest.get("empty")):
+        return True
+
+    inputs = scan_inputs(folder)
+    if manifest is None:
+        # Made before manifests existed, rebuild only if an image is newer than the board and record it otherwise
+        board_mtime = os.stat(pur_file).st_mtime_ns
+        if any(record["mtime"] > board_mtime for record in inputs.values()):
+            return True
+        write_manifest(pur_file, folder, settings, inputs)
+        return False
+
+    if manifest.get("settings") != settings or manifest.get("inputs", {}).keys() != inputs.keys():
+        return True
+
+    touched = False
+    for name, record in inputs.items():
+        recorded = manifest["inputs"][name]
+        if recorded["size"] != record["size"]:
+            return True
+        if recorded["mtime"] != record["mtime"]:  # Only rebuild if the content really changed
+            if recorded.get("hash") != file_hash(os.path.join(folder, name)):
+                return True
+            recorded["mtime"] = record["mtime"]
+            touched = True
+
+    if touched:  # Save the new mtimes so the files are not hashed again next time
+        with open(manifest_path(pur_file), "w") as f:
+            json.dump(manifest, f, indent=1)
+    return False
+
+
+# Boards in pur_folder whose image folder no longer exists, as (pur_file, folder) pairs
+def orphaned_boards(pur_folder):
+    orphans = []
+    for entry in os.scandir(pur_folder):
+        if entry.name.endswith(".pur.json"):
+            pur_file = entry.path[:-len(".json")]
+            manifest = read_manifest(pur_file)
+            if manifest is not None and not os.path.isdir(manifest.get("folder", "")):
+                orphans.append((pur_file, manifest.get("folder", "")))  # pur_file may not exist if it was empty
+    return orphans
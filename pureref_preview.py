@@ -0,0 +1,201 @@
+import io
+import os
+import sys
+import math
+import struct
+import hashlib
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageChops, ImageDraw
+from purformat import PurFile
+from purformat.events import PurEvents, default_events
+from pureref_cache import PngCache
+
+####################################################################################################
+# Render a low resolution preview of a .pur file, for example: python pureref_preview.py board.pur preview.jpg
+# Images are placed with their transform's matrix, x/y and crop points and drawn from the lowest zLayer up.
+# Every image is decoded once, in parallel threads, and reduced to the smallest power of two size the preview
+# needs. Those thumbnails are cached by image content, in memory and optionally on disk, so boards that share
+# images or are rendered again skip decoding. Text is not drawn.
+####################################################################################################
+
+
+class ThumbnailCache:
+
+    # Thumbnails in memory up to max_bytes, least recently used are dropped first
+    # With a PngCache they are also kept on disk between runs
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2, disk: PngCache = None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.memory = OrderedDict()  # (content digest, size) -> RGBA image
+        self.size_bytes = 0
+
+    # Thumbnail of the image with this content digest and size, None if it is not cached
+    def get(self, digest: bytes, size: int):
+        key = (digest, size)
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if self.disk is not None:
+            cached = self.disk.get(digest.hex() + "-" + str(size))
+            if cached is not None:
+                thumbnail = Image.open(io.BytesIO(cached)).convert("RGBA")
+                self.add(digest, size, thumbnail)
+                return thumbnail
+        return None
+
+    def put(self, digest: bytes, size: int, thumbnail: Image.Image):
+        if self.disk is not None:
+            with io.BytesIO() as f:
+                thumbnail.save(f, format="PNG", compress_level=1)
+                self.disk.put(digest.hex() + "-" + str(size), f.getvalue())
+        self.add(digest, size, thumbnail)
+
+    def add(self, digest: bytes, size: int, thumbnail: Image.Image):
+        self.memory[(digest, size)] = thumbnail
+        self.size_bytes += thumbnail.width * thumbnail.height * 4
+        while self.size_bytes > self.max_bytes and len(self.memory) > 1:
+            _, dropped = self.memory.popitem(last=False)
+            self.size_bytes -= dropped.width * dropped.height * 4
+
+
+# The image of png_binary with its longest side at most size pixels, as RGBA
+# Decodes once, then shrinks by whole factors before resampling, which is much faster than resizing directly
+# Pillow releases the GIL while decoding, so this runs in parallel threads
+def make_thumbnail(png_binary, size: int):
+    image = Image.open(io.BytesIO(png_binary))
+    image.thumbnail((size, size), Image.BILINEAR, reducing_gap=2.0)
+    return image.convert("RGBA")
+
+
+# Smallest power of two (at least 16) that is not smaller than pixels, so thumbnails can be shared between sizes
+def size_tier(pixels: float):
+    return max(16, 2 ** math.ceil(math.log2(max(pixels, 1.0))))
+
+
+# Render pur_file with its longest side at most max_size pixels, returns an RGB PIL image
+# cache is an optional ThumbnailCache to share thumbnails between previews, workers is how many images are decoded
+# at the same time. Only the thumbnails this preview needs are held, so memory depends on max_size, not on the board
+def render_preview(pur_file: PurFile, max_size: int = 1024, cache: ThumbnailCache = None,
+                   background=(32, 32, 32), workers: int = os.cpu_count(), events: PurEvents = None):
+    events = default_events(events)
+    cache = ThumbnailCache() if cache is None else cache
+
+    # Every transform with image data, in drawing order
+    placed = [(transform, image) for image in pur_file.images if len(image.pngBinary) > 4
+              for transform in image.transforms]
+    placed.sort(key=lambda pair: pair[0].zLayer)  # Stable, so equal layers keep the order of the file
+
+    corners = [transform.canvas_points() for transform, _ in placed]
+    if not corners:
+        return Image.new("RGB", (1, 1), background)
+    left = min(min(xs) for xs, _ in corners)
+    top = min(min(ys) for _, ys in corners)
+    right = max(max(xs) for xs, _ in corners)
+    bottom = max(max(ys) for _, ys in corners)
+    scale = max_size / max(right - left, bottom - top, 1e-9)
+    preview = Image.new("RGBA", (max(1, math.ceil((right - left) * scale)), max(1, math.ceil((bottom - top) * scale))),
+                        background + (255,))
+
+    with events.phase("thumbnails") as counts:
+        # The size every item is drawn at, an image is only needed as large as its largest item
+        digests = {}  # One hash per image, not per transform
+        tiers = []
+        for transform, image in placed:
+            if id(image) not in digests:
+                digests[id(image)] = hashlib.sha256(image.pngBinary).digest()
+            m = transform.matrix
+            stored_width, stored_height = struct.unpack(">II", image.pngBinary[16:24])  # From the PNG IHDR chunk
+            drawn = max(stored_width * math.hypot(m[0], m[1]), stored_height * math.hypot(m[2], m[3])) * scale
+            tiers.append(size_tier(drawn))
+
+        thumbnails = {}  # (digest, size) -> thumbnail, or the error it could not be made with
+        missing = {}
+        for (transform, image), size in zip(placed, tiers):
+            key = (digests[id(image)], size)
+            if key not in thumbnails and key not in missing:
+                thumbnail = cache.get(*key)
+                if thumbnail is None:
+                    missing[key] = image
+                else:
+                    thumbnails[key] = thumbnail
+
+        def make(key):
+            try:
+                return make_thumbnail(missing[key].pngBinary, key[1])
+            except (OSError, ValueError, Image.DecompressionBombError) as error:
+                return error
+
+        with ThreadPoolExecutor(workers) as executor:
+            for done, (key, thumbnail) in enumerate(zip(missing, executor.map(make, missing))):
+                events.progress("thumbnails", done + 1, len(missing))
+                thumbnails[key] = thumbnail
+                if isinstance(thumbnail, Image.Image):
+                    cache.put(*key, thumbnail)
+        counts["images"] = len(digests)
+        counts["decoded"] = len(missing)
+
+    with events.phase("preview") as counts:
+        for done, ((transform, image), (xs, ys), size) in enumerate(zip(placed, corners, tiers)):
+            events.progress("preview", done, len(placed))
+            m = transform.matrix
+            determinant = m[0] * m[3] - m[1] * m[2]
+            thumbnail = thumbnails[(digests[id(image)], size)]
+            if not isinstance(thumbnail, Image.Image):
+                events.message("Could not draw image " + transform.name + " (" + str(thumbnail) + ")")
+                continue
+            if determinant == 0:
+                continue
+
+            # Part of the preview the item covers
+            xs = [(x - left) * scale for x in xs]
+            ys = [(y - top) * scale for y in ys]
+            x0, y0 = max(0, math.floor(min(xs))), max(0, math.floor(min(ys)))
+            x1, y1 = min(preview.width, math.ceil(max(xs))), min(preview.height, math.ceil(max(ys)))
+            if x1 <= x0 or y1 <= y0:
+                continue
+
+            # Region position -> canvas -> item coordinates -> image position, which is what Image.transform wants
+            # The image's top left is at xCrop, yCrop in item coordinates
+            factor = thumbnail.width / struct.unpack(">I", image.pngBinary[16:20])[0]
+            a, b, c, d = m[3] / determinant, -m[2] / determinant, -m[1] / determinant, m[0] / determinant
+            offset_x = x0 / scale + left - transform.x
+            offset_y = y0 / scale + top - transform.y
+            coefficients = (
+                factor * a / scale, factor * b / scale, factor * (a * offset_x + b * offset_y - transform.xCrop),
+                factor * c / scale, factor * d / scale, factor * (c * offset_x + d * offset_y - transform.yCrop),
+            )
+            region = thumbnail.transform((x1 - x0, y1 - y0), Image.AFFINE, coefficients, Image.BILINEAR)
+
+            # Only what is inside the crop points is visible
+            mask = Image.new("L", region.size, 0)
+            ImageDraw.Draw(mask).polygon([(x - x0, y - y0) for x, y in zip(xs, ys)], fill=255)
+            region.putalpha(ImageChops.multiply(region.getchannel("A"), mask))
+            preview.alpha_composite(region, (x0, y0))
+
+        counts["items"] = len(placed)
+    return preview.convert("RGB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a preview of a .pur file")
+    parser.add_argument("purfile", help=".pur file to render")
+    parser.add_argument("output", help="image to save, PNG or JPEG by extension")
+    parser.add_argument("--max-size", type=int, default=1024, help="longest side of the preview in pixels")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="images decoded at the same time")
+    parser.add_argument("--cache", help="folder to keep thumbnails in, so images are not decoded again next time")
+    parser.add_argument("--cache-size", type=int, default=512, help="maximum cache size in MB, default 512")
+    arguments = parser.parse_args(argv)
+
+    disk = PngCache(arguments.cache, arguments.cache_size * 1024 * 1024) if arguments.cache else None
+    pur_file = PurFile.open(arguments.purfile, lazy=True)  # Image data is only paged in when it is decoded
+    preview = render_preview(pur_file, arguments.max_size, ThumbnailCache(disk=disk), workers=arguments.workers)
+    preview.save(arguments.output)
+    if disk is not None:
+        disk.evict()
+    print("Saved " + arguments.output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,2 +1,15 @@
 from . import items, purformat, read, write
 from .purformat import PurFile
+from .events import PurEvents
+from .summary import PurSummary, scan
+from .extract import extract
+from .patch import PurPatch
+from .verify import verify, PurVerification
+
+
+# PurExecutor is imported on first use, asyncio takes longer to import than the rest of the package
+def __getattr__(name):
+    if name == "PurExecutor":
+        from .aio import PurExecutor
+        return PurExecutor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import sys
+from .summary import scan
+from .merge import merge_files
+from .extract import extract
+from .verify import verify
+
+####################################################################################################
+# Command line tools for .pur files, for example: python -m purformat inspect Purs/*.pur
+####################################################################################################
+
+
+def inspect(arguments):
+    failed = False
+    for path in arguments.files:
+        try:
+            summary = scan(path)
+        except Exception as error:  # One broken board should not stop the rest
+            print(path + ": error: " + str(error), file=sys.stderr)
+            failed = True
+            continue
+
+        if arguments.json:
+            print(json.dumps(summary.to_dict()))
+            continue
+
+        print(f"{path}: {summary.fileSize} bytes, {summary.imageCount} images ({summary.imageBytes} bytes), "
+              f"{len(summary.imageItems)} image items, {len(summary.textItems)} text items")
+        print(f"  canvas {summary.canvas}, zoom {summary.zoom}, view {summary.xCanvas} {summary.yCanvas}")
+        if arguments.verbose:
+            for name, source in summary.imageItems:
+                print(f"  image {name!r} from {source!r}")
+            for text in summary.textItems:
+                print(f"  text {text!r}")
+    return 1 if failed else 0
+
+
+def merge(arguments):
+    try:
+        merge_files(arguments.files, arguments.output, arguments.gap)
+    except Exception as error:
+        print(arguments.output + ": error: " + str(error), file=sys.stderr)
+        return 1
+    print(f"Merged {len(arguments.files)} files into {arguments.output}")
+    return 0
+
+
+def extract_images(arguments):
+    failed = False
+    for path in arguments.files:
+        folder = arguments.output or os.path.splitext(path)[0]
+        if arguments.output and len(arguments.files) > 1:  # Keep the images of every board apart
+            folder = os.path.join(arguments.output, os.path.splitext(os.path.basename(path))[0])
+        try:
+            paths = extract(path, folder, arguments.workers)
+        except Exception as error:  # One broken board should not stop the rest
+            print(path + ": error: " + str(error), file=sys.stderr)
+            failed = True
+            continue
+        print(f"{path}: {len(paths)} images saved to {folder}")
+    return 1 if failed else 0
+
+
+# .pur files in paths, folders are searched recursively
+def find_pur_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, files in os.walk(path):
+                for file in sorted(files):
+                    if file.lower().endswith(".pur"):
+                        yield os.path.join(folder, file)
+        else:
+            yield path
+
+
+def verify_files(arguments):
+    from concurrent.futures import ThreadPoolExecutor  # Here so the other commands start fast
+    # One JSON object per file on stdout, in the order the files were found
+    failed = checked = 0
+    with ThreadPoolExecutor(arguments.workers) as executor:  # Hashing releases the GIL
+        for result in executor.map(verify, find_pur_files(arguments.paths)):
+            checked += 1
+            failed += not result.ok
+            print(json.dumps(result.to_dict()), flush=True)
+    print(f"{checked} files checked, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m purformat", description="Tools for PureRef .pur files")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    inspect_parser = commands.add_parser("inspect", help="print a summary of .pur files without loading images")
+    inspect_parser.add_argument("files", nargs="+", help=".pur files to inspect")
+    inspect_parser.add_argument("--json", action="store_true", help="print one JSON object per file")
+    inspect_parser.add_argument("-v", "--verbose", action="store_true", help="also list every item")
+    inspect_parser.set_defaults(run=inspect)
+
+    merge_parser = commands.add_parser("merge", help="merge .pur files side by side into one board")
+    merge_parser.add_argument("output", help=".pur file to write, can be one of the inputs")
+    merge_parser.add_argument("files", nargs="+", help=".pur files to merge, from left to right")
+    merge_parser.add_argument("--gap", type=float, default=100.0, help="space between boards on the canvas")
+    merge_parser.set_defaults(run=merge)
+
+    extract_parser = commands.add_parser("extract", help="save every image in .pur files as .png")
+    extract_parser.add_argument("files", nargs="+", help=".pur files to extract")
+    extract_parser.add_argument("-o", "--output", help="folder for the images, by default a folder named after "
+                                                       "the .pur file next to it")
+    extract_parser.add_argument("-w", "--workers", type=int, default=4, help="images written at the same time")
+    extract_parser.set_defaults(run=extract_images)
+
+    verify_parser = commands.add_parser("verify", help="check the checksum and structure of .pur files")
+    verify_parser.add_argument("paths", nargs="+", help=".pur files, or folders to search for them")
+    verify_parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="files checked at once")
+    verify_parser.set_defaults(run=verify_files)
+
+    arguments = parser.parse_args(argv)
+    return arguments.run(arguments)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
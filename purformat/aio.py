@@ -0,0 +1,98 @@
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from .purformat import PurFile
+from .events import PurEvents, default_events
+
+########################################################################################################################
+# Asyncio counterparts of PurFile.read and PurFile.write: await PurFile.aread(path) and await pur_file.awrite(path)
+# Reading and writing run in a bounded thread pool so the event loop keeps running. File I/O and hashing release
+# the GIL, parsing does not, but the loop still gets its turn between the worker's bytecodes.
+# At most limit reads and writes run at once, the rest wait in the event loop where they can be cancelled for free.
+# A cancelled read or write that already started stops at its next phase or image, a cancelled write never
+# replaces the target file. Event callbacks are called from the worker thread.
+# Reading large boards allocates many items, the garbage collections this triggers pause every thread; services
+# that keep many boards in memory can move them out of the collector's way with gc.freeze().
+########################################################################################################################
+
+
+class PurCancelled(Exception):
+    # Raised inside the worker to stop a read or write whose task was cancelled
+    pass
+
+
+class CancellableEvents(PurEvents):
+    # Passes everything on to events, but stops the read or write as soon as cancelled is set
+    def __init__(self, events: PurEvents, cancelled: threading.Event):
+        super().__init__(events.callback)
+        self.events = events
+        self.timings = events.timings  # Shared, so the caller's events get the timings
+        self.cancelled = cancelled
+
+    def emit(self, event: str, **data):
+        if self.cancelled.is_set():
+            raise PurCancelled()
+        self.events.emit(event, **data)
+
+
+class PurExecutor:
+    # Runs reads and writes on worker threads, with at most limit of them running or queued at once
+    def __init__(self, workers: int = min(4, os.cpu_count() or 1), limit: Optional[int] = None):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="purformat")
+        self.limit = limit or workers
+        self.semaphores = weakref.WeakKeyDictionary()  # One per event loop, a semaphore can't be shared between loops
+
+    def semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.limit)
+        return self.semaphores[loop]
+
+    # Run function(events) on a worker, events is a CancellableEvents wrapping the given events
+    async def run(self, function: Callable[[PurEvents], object], events: Optional[PurEvents] = None):
+        cancelled = threading.Event()
+        events = CancellableEvents(default_events(events), cancelled)
+
+        async with self.semaphore():
+            future = self.executor.submit(function, events)
+            result = asyncio.wrap_future(future)
+            try:
+                return await asyncio.shield(result)
+            except asyncio.CancelledError:
+                # Stop the worker and wait for it, so the limit holds and a cancelled write has cleaned up
+                if not future.cancel():
+                    cancelled.set()
+                    await asyncio.wait([result])
+                    if not result.cancelled():
+                        result.exception()  # Most likely PurCancelled, which nobody is waiting for anymore
+                raise
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait)
+
+
+_default_executor: Optional[PurExecutor] = None
+
+
+# The executor used when none is given, created on first use
+def default_executor():
+    global _default_executor
+    if _default_executor is None:
+        _default_executor = PurExecutor()
+    return _default_executor
+
+
+def set_default_executor(executor: PurExecutor):
+    global _default_executor
+    _default_executor = executor
+
+
+async def aread(file: str, lazy: bool = False, events: PurEvents = None, executor: PurExecutor = None):
+    return await (executor or default_executor()).run(lambda run_events: PurFile.open(file, lazy, run_events), events)
+
+
+async def awrite(pur_file: PurFile, file, events: PurEvents = None, executor: PurExecutor = None):
+    await (executor or default_executor()).run(lambda run_events: pur_file.write(file, run_events), events)
@@ -0,0 +1,129 @@
+from array import array
+from itertools import chain
+from operator import attrgetter, itemgetter
+import numpy as np
+from .purformat import PurFile
+
+########################################################################################################################
+# Columnar NumPy view of all image transforms in a PurFile, to edit large boards without Python loops per item
+# NumPy is only needed for this module: pur_file.transform_arrays() returns a PurTransforms
+# The compact arrays of the items are joined into the columns in one go, and apply() only writes back what changed
+########################################################################################################################
+
+columns = ("matrix", "position", "zLayer", "points")
+
+
+class PurTransforms:
+
+    # Copies every image transform into arrays, row i belongs to items[i]
+    # Edit the arrays directly or with the batch methods, then call apply() to write them back to the items
+    def __init__(self, pur_file: PurFile):
+        self.pur_file = pur_file
+        self.items = [transform for image in pur_file.images for transform in image.transforms]
+        items = self.items
+        count = len(items)
+
+        # item.matrix is an array of 4 doubles, so joining their buffers gives the whole column
+        # The slots behind the properties are read directly, the property calls would cost more than the join
+        matrices = list(map(attrgetter("_matrix"), items))
+        self.matrix = np.frombuffer(bytearray().join(matrices), float).reshape(count, 4)
+        self.position = np.empty((count, 2))  # x, y
+        self.position[:, 0] = np.fromiter(map(attrgetter("x"), items), float, count)
+        self.position[:, 1] = np.fromiter(map(attrgetter("y"), items), float, count)
+        self.zLayer = np.fromiter(map(attrgetter("zLayer"), items), float, count)
+
+        # Crop points as [x coordinates, y coordinates] per item, padded with NaN if some items have more points
+        points = list(map(attrgetter("_points"), items))
+        self.pointCount = np.fromiter(map(len, map(itemgetter(0), points)), int, count)
+        size = int(self.pointCount.max()) if count else 0
+        if count and (self.pointCount == size).all():
+            self.points = np.frombuffer(bytearray().join(chain.from_iterable(points)), float).reshape(count, 2, size)
+        else:
+            self.points = np.full((count, 2, size), np.nan)
+            for i, (x_points, y_points) in enumerate(points):
+                self.points[i, 0, :len(x_points)] = x_points
+                self.points[i, 1, :len(y_points)] = y_points
+
+        self.loaded = {name: getattr(self, name).copy() for name in columns}  # To find what apply() has to write
+
+    def __len__(self):
+        return len(self.items)
+
+    # Same as item.width and item.height, for all items
+    @property
+    def width(self):
+        return (self.points[:, 0, 2] - self.points[:, 0, 0]) * self.matrix[:, 0]
+
+    @property
+    def height(self):
+        return (self.points[:, 1, 2] - self.points[:, 1, 0]) * self.matrix[:, 3]
+
+    # Scale every item around its own position, factor can be a number or one per item
+    def scale(self, factor):
+        self.matrix *= np.reshape(factor, (-1, 1))
+
+    def translate(self, dx: float, dy: float):
+        self.position += (dx, dy)
+
+    # Scale every item to the same height, like item.scale_to_height
+    def normalize_heights(self, height: float):
+        self.scale(height / self.height)
+
+    # Corners of the crop points of every item on the canvas, as (x, y) arrays of shape (items, points)
+    def canvas_points(self):
+        x, y = self.points[:, 0], self.points[:, 1]
+        m = self.matrix
+        canvas_x = m[:, 0:1] * x + m[:, 2:3] * y + self.position[:, 0:1]
+        canvas_y = m[:, 1:2] * x + m[:, 3:4] * y + self.position[:, 1:2]
+        return canvas_x, canvas_y
+
+    # (left, top, right, bottom) around every item on the canvas
+    def bounding_box(self):
+        if not len(self):
+            return 0.0, 0.0, 0.0, 0.0
+        canvas_x, canvas_y = self.canvas_points()
+        return (float(np.nanmin(canvas_x)), float(np.nanmin(canvas_y)),
+                float(np.nanmax(canvas_x)), float(np.nanmax(canvas_y)))
+
+    # Set the canvas around all items with a margin, and zoom and center the view so everything fits in view_size
+    def fit_canvas(self, margin: float = 1000.0, view_size=(1920, 1080)):
+        left, top, right, bottom = self.bounding_box()
+        width, height = right - left, bottom - top
+        # Same order as the default canvas of -10000 to 10000 around the origin
+        self.pur_file.canvas = [left - margin, top - margin, right + margin, bottom + margin]
+        if width > 0 and height > 0:
+            self.pur_file.zoom = min(view_size[0] / width, view_size[1] / height)
+        self.pur_file.xCanvas, self.pur_file.yCanvas = int((left + right) / 2), int((top + bottom) / 2)
+
+    # Rows of column that differ from what the items hold
+    def changed_rows(self, name: str):
+        new, old = getattr(self, name), self.loaded[name]
+        if new.shape != old.shape:
+            return np.arange(len(self))
+        differs = (new != old) & ~(np.isnan(new) & np.isnan(old))
+        return np.flatnonzero(differs.any(axis=tuple(range(1, differs.ndim))))  # Any value of a row
+
+    # Write the arrays back to the items, only the rows and columns that were changed are written
+    # Rows are handed over as arrays and floats rather than lists, which the garbage collector would have to track
+    def apply(self):
+        items = self.items
+        rows = self.changed_rows("matrix")
+        matrices = array("d", self.matrix[rows].tobytes())
+        for k, i in enumerate(rows.tolist()):
+            items[i]._matrix = matrices[4 * k:4 * k + 4]  # Slicing gives the item its own array of 4 doubles
+
+        rows = self.changed_rows("position")
+        for i, x, y in zip(rows.tolist(), self.position[rows, 0].tolist(), self.position[rows, 1].tolist()):
+            item = items[i]
+            item.x, item.y = x, y
+
+        rows = self.changed_rows("zLayer")
+        for i, z_layer in zip(rows.tolist(), self.zLayer[rows].tolist()):
+            items[i].zLayer = z_layer
+
+        rows = self.changed_rows("points")
+        counts = self.pointCount.tolist()
+        for i, (x_points, y_points) in zip(rows.tolist(), self.points[rows].tolist()):
+            items[i].points = [x_points[:counts[i]], y_points[:counts[i]]]
+
+        self.loaded = {name: getattr(self, name).copy() for name in columns}
@@ -0,0 +1,47 @@
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+
+def print_message(event: str, data: dict):
+    # Default callback, prints what used to be printed before events existed
+    if "message" in data:
+        print(data["message"])
+
+
+class PurEvents:
+    # Opt-in instrumentation for read_pur_file, write_pur_file and pureref_gen.generate
+    # callback(event, data) is called with:
+    #   "phase"    when a phase ends: phase, seconds and counts like bytes or items
+    #   "progress" while a phase runs: phase, done, total and what was just done
+    #   "message"  for warnings and notes: message
+    # Without a callback nothing is reported, without PurEvents at all messages are printed
+    def __init__(self, callback: Optional[Callable[[str, dict], None]] = None):
+        self.callback = callback
+        self.timings: Dict[str, float] = {}  # total seconds per phase
+
+    def emit(self, event: str, **data):
+        if self.callback is not None:
+            self.callback(event, data)
+
+    def message(self, message: str, **data):
+        self.emit("message", message=message, **data)
+
+    def progress(self, phase: str, done: int, total: int, **data):
+        self.emit("progress", phase=phase, done=done, total=total, **data)
+
+    # Time a phase, counts added to the yielded dict are sent with the phase event
+    @contextmanager
+    def phase(self, phase: str):
+        counts = {}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - start
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+            self.emit("phase", phase=phase, seconds=seconds, **counts)
+
+
+def default_events(events: Optional[PurEvents]):
+    return PurEvents(print_message) if events is None else events
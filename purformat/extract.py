@@ -0,0 +1,83 @@
+import os
+import re
+from typing import List, Union
+from .items import PurImage
+from .purformat import PurFile
+from .events import PurEvents, default_events
+
+########################################################################################################################
+# Save every image in a .pur file as a .png, named after its item
+# The board is read lazily, so only the items are parsed and every image is copied straight from the file to disk.
+# On Linux the kernel copies the bytes with os.copy_file_range, elsewhere they are written from the memory map.
+# Several images are written at once, both kinds of copy release the GIL so the threads really run in parallel.
+########################################################################################################################
+
+invalid_characters = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+# A file name for image without extension, from the name or source of its first transform
+def image_name(image: PurImage):
+    transform = image.transforms[0] if image.transforms else None
+    for name in ([transform.name, transform.source] if transform else []):
+        if name and name != "BruteForceLoaded":
+            name = re.split(r"[/\\]", name)[-1]  # Names can be full paths, from any OS
+            name = os.path.splitext(name)[0] if name.lower().endswith((".png", ".jpg", ".jpeg")) else name
+            name = invalid_characters.sub("_", name).strip(" .")[:200]
+            if name:
+                return name
+    return "image"
+
+
+# Names that don't collide with each other or with files already in folder, case insensitive for Windows and macOS
+def unique_paths(names: List[str], folder: str):
+    taken = {name.lower() for name in os.listdir(folder)}
+    paths = []
+    for name in names:
+        candidate, number = name + ".png", 2
+        while candidate.lower() in taken:
+            candidate = f"{name} ({number}).png"
+            number += 1
+        taken.add(candidate.lower())
+        paths.append(os.path.join(folder, candidate))
+    return paths
+
+
+def copy_image(source: int, image: PurImage, path: str):
+    start, end = image.address
+    with open(path, "wb") as f:
+        if hasattr(os, "copy_file_range"):
+            try:
+                while start < end:  # Can copy less than asked for
+                    copied = os.copy_file_range(source, f.fileno(), end - start, start)
+                    if copied == 0:
+                        break
+                    start += copied
+                if start == end:
+                    return
+            except OSError:  # Not supported between these file systems, fall back to writing from the map
+                f.seek(0)
+                f.truncate()
+        f.write(image.pngBinary)
+
+
+# Save all images of the board at pur_path to folder, which is created if needed. Returns the paths written
+# Duplicates are saved once, links to images outside the board have no image data and are skipped
+def extract(pur_path: Union[str, os.PathLike], folder: Union[str, os.PathLike], workers: int = 4,
+            events: PurEvents = None):
+    from concurrent.futures import ThreadPoolExecutor, as_completed  # Here so importing purformat stays fast
+    events = default_events(events)
+    os.makedirs(folder, exist_ok=True)
+    with PurFile.open(pur_path, lazy=True, events=events) as pur_file:
+        images = [image for image in pur_file.images if len(image.pngBinary) > 4]
+        paths = unique_paths([image_name(image) for image in images], str(folder))
+
+        with events.phase("extract") as counts, open(pur_path, "rb") as source, \
+                ThreadPoolExecutor(workers) as executor:
+            futures = {executor.submit(copy_image, source.fileno(), image, path): path
+                       for image, path in zip(images, paths)}
+            for done, future in enumerate(as_completed(futures)):
+                future.result()
+                events.progress("extract", done + 1, len(futures), path=futures[future])
+            counts["images"] = len(images)
+            counts["bytes"] = sum(len(image.pngBinary) for image in images)
+    return paths
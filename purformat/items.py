@@ -1,8 +1,25 @@
+from array import array
 from typing import List
 
 
+# Attribute stored as a compact array of typecode, anything assigned to it is converted
+# Boards can have many thousands of items, a list of Python floats takes several times more memory
+def array_property(name: str, typecode: str):
+    def get(self):
+        return getattr(self, name)
+
+    def set(self, value):
+        setattr(self, name, array(typecode, value))
+
+    return property(get, set)
+
+
 # Abstract item class
 class Item:
+    __slots__ = ("id", "zLayer", "_matrix", "x", "y", "textChildren")
+
+    matrix = array_property("_matrix", "d")
+
     def __init__(self):
         self.id = 0
         self.zLayer = 1.0
@@ -16,6 +33,10 @@ class Item:
 # Similar to image transform, but this carries its own content (text)
 class PurGraphicsTextItem(Item):
     # Part of a PureRefObj
+    __slots__ = ("text", "opacity", "_rgb", "opacityBackground", "_rgbBackground")
+
+    rgb = array_property("_rgb", "H")
+    rgbBackground = array_property("_rgbBackground", "H")
 
     def __init__(self):
         super().__init__()
@@ -33,6 +54,9 @@ class PurGraphicsImageItem(Item):
     # Part of a PurImage
     # Be aware: PureRef transforms have an alternative second format for
     # rotated cropping where the image is no longer a rectangle
+    __slots__ = ("source", "name", "_matrixBeforeCrop", "xCrop", "yCrop", "scaleCrop", "pointCount", "_points")
+
+    matrixBeforeCrop = array_property("_matrixBeforeCrop", "d")
 
     def __init__(self):
         super().__init__()
@@ -48,6 +72,15 @@ class PurGraphicsImageItem(Item):
             [[-1000, 1000, 1000, -1000, -1000],
              [-1000, -1000, 1000, 1000, -1000]]  # 4 byte 01 and 2 doubles
 
+    # [x coordinates, y coordinates], each an array of doubles
+    @property
+    def points(self):
+        return self._points
+
+    @points.setter
+    def points(self, value):
+        self._points = [array("d", value[0]), array("d", value[1])]
+
     @property
     def width(self):
         return (self.points[0][2] - self.points[0][0]) * self.matrix[0]
@@ -64,6 +97,12 @@ class PurGraphicsImageItem(Item):
     def height(self, value):
         self.matrix[3] = value / (self.points[1][2] - self.points[1][0])
 
+    # The crop points on the canvas, as [x coordinates, y coordinates]
+    def canvas_points(self):
+        m = self.matrix
+        return [[m[0] * x + m[2] * y + self.x for x, y in zip(*self.points)],
+                [m[1] * x + m[3] * y + self.y for x, y in zip(*self.points)]]
+
     def scale(self, factor):
         self.matrix[0] *= factor
         self.matrix[3] *= factor
@@ -90,7 +129,11 @@ class PurGraphicsImageItem(Item):
 class PurImage:
     # Part of a PureRefObj
     # Holds an image and its transform(s) (usually only one)
+    __slots__ = ("_address", "pngBinary", "transforms")
+
+    address = array_property("_address", "q")  # original location for identification
+
     def __init__(self):
-        self.address = [0, 0]  # original location for identification
-        self.pngBinary = bytearray()  # image data
+        self.address = [0, 0]
+        self.pngBinary = bytearray()  # image data, a memoryview into the file if it was read lazily
         self.transforms: List[PurGraphicsImageItem] = []  # transforms[] for multiple instances
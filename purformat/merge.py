@@ -0,0 +1,94 @@
+import os
+from typing import List, Union
+from .purformat import PurFile
+from .write import replacing
+from .events import PurEvents, default_events
+
+########################################################################################################################
+# Merge .pur files into one board, placed side by side from left to right with their tops lined up
+# Inputs are read lazily, so only their items are parsed and image data stays in the memory-mapped files until the
+# writer streams it into the output as-is. Memory use depends on the number of items, not on the size of the images.
+# The writer gives every transform and text a new ID and rebuilds duplicates and the reference table.
+########################################################################################################################
+
+
+# (left, top, right, bottom) around all image transforms and top level text of a board, None if it is empty
+def bounding_box(pur_file: PurFile):
+    xs, ys = [], []
+    for image in pur_file.images:
+        for transform in image.transforms:
+            x_points, y_points = transform.canvas_points()
+            xs += x_points
+            ys += y_points
+    for text in pur_file.text:  # Text has no size in the file, so only its position counts
+        xs.append(text.x)
+        ys.append(text.y)
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+# Move every image transform and top level text, children are relative to their parent and move with it
+def translate(pur_file: PurFile, dx: float, dy: float):
+    for image in pur_file.images:
+        for transform in image.transforms:
+            transform.x += dx
+            transform.y += dy
+    for text in pur_file.text:
+        text.x += dx
+        text.y += dy
+
+
+# Merge the boards in files into a new PurFile, gap is the space between boards on the canvas
+# Image data of the result is still in the input files, so write it before they change and close() it afterwards
+def merge(files: List[Union[str, os.PathLike]], gap: float = 100.0, events: PurEvents = None):
+    events = default_events(events)
+    merged = PurFile()
+    boxes = []
+
+    with events.phase("merge") as counts:
+        placement_x = 0.0
+        for done, file in enumerate(files):
+            pur_file = PurFile.open(file, lazy=True, events=events)
+            box = bounding_box(pur_file)
+            events.progress("merge", done + 1, len(files), file=str(file))
+            if box is None:
+                events.message("Nothing to merge in " + str(file))
+                pur_file.close()
+                continue
+
+            left, top, right, bottom = box
+            translate(pur_file, placement_x - left, -top)
+            boxes.append((placement_x, 0.0, placement_x + right - left, bottom - top))
+            placement_x += right - left + gap
+
+            if len(boxes) == 1:
+                merged.zoom = pur_file.zoom
+                merged.folderLocation = pur_file.folderLocation
+            merged.images += pur_file.images
+            merged.text += pur_file.text
+            merged.maps += pur_file.maps  # Closing the merged board releases the inputs
+
+        counts["boards"] = len(boxes)
+        counts["images"] = len(merged.images)
+
+    if boxes:
+        left, top = min(box[0] for box in boxes), min(box[1] for box in boxes)
+        right, bottom = max(box[2] for box in boxes), max(box[3] for box in boxes)
+        # Canvas around everything like the default -10000 to 10000, and the view centered and zoomed out to fit
+        margin = max(right - left, bottom - top)
+        merged.canvas = [left - margin, top - margin, right + margin, bottom + margin]
+        merged.xCanvas, merged.yCanvas = int((left + right) / 2), int((top + bottom) / 2)
+        first_width = boxes[0][2] - boxes[0][0]
+        if first_width > 0:
+            merged.zoom *= first_width / (right - left)
+    return merged
+
+
+# Merge the boards in files and write the result to output, which may be one of the inputs
+# The inputs are closed before output is replaced, since Windows can't replace a file that is still mapped
+def merge_files(files: List[Union[str, os.PathLike]], output: Union[str, os.PathLike], gap: float = 100.0,
+                events: PurEvents = None):
+    with replacing(output) as f:
+        with merge(files, gap, events) as merged:
+            merged.write(f, events)
@@ -0,0 +1,145 @@
+import os
+import struct
+import hashlib
+from typing import Union
+from .items import PurGraphicsTextItem
+from .purformat import PurFile
+from .read import read_pur_file
+from .records import encode_image_item, encode_text_item, pack_string
+from .events import PurEvents, default_events
+
+########################################################################################################################
+# Edit the items of a .pur file without rewriting its images
+#   patch = PurPatch("board.pur")
+#   patch.pur_file.images[0].transforms[0].x += 100
+#   patch.save()
+# The file is read lazily and its memory map released straight away, so image data is never loaded (pngBinary can't be
+# used) and save() can resize the file on Windows too. save() only writes from the items onwards, and if the items
+# keep their size only the bytes that changed. The reference table is kept as it is, so images and transforms can't
+# be added or removed, but everything about them can be changed, and text can be added, removed and edited freely.
+# The checksum covers the images too, so they are still read once to hash them, but never written.
+# A crash while saving can leave the file broken, use PurFile.write when that matters more than speed.
+########################################################################################################################
+
+hash_chunk_size = 1024 * 1024
+
+
+# Start and end of the bytes that differ between two buffers of the same length
+# Compares blocks first so only one block per end is compared byte by byte in Python
+def changed_range(new: bytes, old: bytes, block: int = 4096):
+    length = len(new)
+    first = next((start for start in range(0, length, block)
+                  if new[start:start + block] != old[start:start + block]), length)
+    first = next((i for i in range(first, min(first + block, length)) if new[i] != old[i]), length)
+
+    last = next((stop for stop in range(length, first, -block)
+                 if new[max(first, stop - block):stop] != old[max(first, stop - block):stop]), first)
+    last = next((i for i in range(last, max(first, last - block), -1) if new[i - 1] != old[i - 1]), first)
+    return first, last
+
+
+class PurPatch:
+    def __init__(self, path: Union[str, os.PathLike], events: PurEvents = None):
+        self.path = path
+        self.pur_file = PurFile()
+        self.sections = read_pur_file(self.pur_file, path, lazy=True, events=events)
+        self.pur_file.close()  # Image data is never needed, and Windows can't truncate a file that is mapped
+        # What the reference table and the duplicates in the image data depend on, save() checks it didn't change
+        self.structure = self.image_structure()
+
+    def image_structure(self):
+        return [(id(image), [transform.id for transform in image.transforms]) for image in self.pur_file.images]
+
+    # Everything after the images: items, folder location and the unchanged reference table
+    def encode_tail(self, references: bytes):
+        pur_file = self.pur_file
+        image_items = sum(len(image.transforms) for image in pur_file.images)
+        # Text IDs follow the image IDs, which must stay as they are since duplicates and references use them
+        next_id = max((transform.id + 1 for image in pur_file.images for transform in image.transforms), default=0)
+        pur_file.count_text_items(next_id)
+        next_free_id = next_id
+
+        tail = bytearray()
+        address = self.sections["items"]
+
+        def add_text(text_transform: PurGraphicsTextItem):
+            nonlocal next_free_id
+            tail.extend(encode_text_item(text_transform, address + len(tail)))
+            next_free_id = max(next_free_id, text_transform.id + 1)
+            list(map(add_text, text_transform.textChildren))
+
+        for image in pur_file.images:
+            for transform in image.transforms:
+                tail.extend(encode_image_item(transform, address + len(tail)))
+                list(map(add_text, transform.textChildren))
+        list(map(add_text, pur_file.text))
+
+        tail.extend(pack_string(pur_file.folderLocation))
+        file_length = address + len(tail)  # Header file_length, which is where refs begin
+        tail.extend(references)
+        return tail, file_length, image_items, next_free_id
+
+    # Write the changes to the file, returns how many bytes were written
+    def save(self, events: PurEvents = None):
+        events = default_events(events)
+        if self.image_structure() != self.structure:
+            raise ValueError("Images or image transforms were added, removed or reordered, use PurFile.write instead")
+
+        items_start = self.sections["items"]
+        with open(self.path, "r+b") as f:
+            with events.phase("items") as counts:
+                f.seek(self.sections["references"])
+                references = f.read()
+                f.seek(items_start)
+                old_tail = f.read(self.sections["references"] - items_start) + references
+                tail, file_length, image_items, next_free_id = self.encode_tail(references)
+
+                if len(tail) == len(old_tail):  # Overwrite only the bytes that changed
+                    first, last = changed_range(tail, old_tail)
+                    f.seek(items_start + first)
+                    f.write(tail[first:last])
+                    written = last - first
+                else:
+                    f.seek(items_start)
+                    f.write(tail)
+                    f.truncate()
+                    written = len(tail)
+                counts["bytes"] = written
+
+            with events.phase("header"):
+                f.seek(0)
+                header = bytearray(f.read(224))
+                text_items = len(self.pur_file.text)
+                if image_items + text_items > 65535:
+                    raise ValueError(f"A .pur file holds at most 65535 items, this one has {image_items + text_items}")
+                header[12:16] = struct.pack(">HH", image_items + text_items, image_items)
+                header[16:24] = struct.pack(">Q", file_length)
+                header[108:112] = struct.pack(">I", max(struct.unpack_from(">I", header, 108)[0], next_free_id))
+                pur_file = self.pur_file
+                header[112:152] = struct.pack(">5d", *pur_file.canvas, pur_file.zoom)
+                header[176:184] = struct.pack(">d", pur_file.zoom)
+                header[216:224] = struct.pack(">ii", pur_file.xCanvas, pur_file.yCanvas)
+
+            with events.phase("checksum") as counts:
+                # MD5 of everything from byte 108, the images are read from the file but stay as they are
+                md5 = hashlib.md5(header[108:])
+                f.seek(224)
+                remaining = items_start - 224
+                while remaining > 0:
+                    chunk = f.read(min(hash_chunk_size, remaining))
+                    if not chunk:
+                        break
+                    md5.update(chunk)
+                    remaining -= len(chunk)
+                md5.update(tail)
+                header[44:108] = md5.hexdigest().encode("utf-16-be")
+                counts["bytes"] = items_start - 224 + len(tail)
+
+            f.seek(0)
+            f.write(header)
+            written += 224
+
+        self.sections["folderLocation"] = file_length - len(pack_string(self.pur_file.folderLocation))
+        self.sections["references"] = file_length
+        self.sections["end"] = items_start + len(tail)
+        return written
@@ -1,5 +1,6 @@
 from typing import List
 import os
+import hashlib
 from .items import PurImage, PurGraphicsTextItem
 
 ########################################################################################################################
@@ -21,16 +22,88 @@ class PurFile:
         self.folderLocation = os.getcwd()
         self.images: List[PurImage] = []  # image list
         self.text: List[PurGraphicsTextItem] = []  # text list
+        self.maps = []  # memory maps of lazily read files, released by close()
 
     # Import a .pur file into this object
-    def read(self, file: str):
+    # If lazy, the file is memory-mapped and every pngBinary is a view into it that is only loaded when accessed
+    # events is an optional PurEvents to receive timings and progress
+    def read(self, file: str, lazy: bool = False, events=None):
         from purformat.read import read_pur_file
-        read_pur_file(self, file)
+        read_pur_file(self, file, lazy, events)
 
-    # Export this object to a .pur file
-    def write(self, file: str):
+    # Create a new object from a .pur file, see read
+    @classmethod
+    def open(cls, file: str, lazy: bool = False, events=None):
+        pur_file = cls()
+        pur_file.read(file, lazy, events)
+        return pur_file
+
+    # Release the memory maps of lazily read files, the image data read from them can't be used afterwards
+    # Windows can't replace or resize a file while it is mapped, so close a lazily read board before it is overwritten
+    # Also a context manager: with PurFile.open(path, lazy=True) as pur_file: ...
+    def close(self):
+        for image in self.images:
+            if isinstance(image.pngBinary, memoryview):
+                image.pngBinary.release()
+        for mapped in self.maps:
+            mapped.close()
+        self.maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Export this object to a .pur file, or to a seekable binary file object
+    def write(self, file, events=None):
         from purformat.write import write_pur_file
-        write_pur_file(self, file)
+        write_pur_file(self, file, events)
+
+    # Merge .pur files side by side into a new PurFile, images are copied from the input files when it is written
+    # See merge.py, gap is the space between boards on the canvas
+    @classmethod
+    def merge(cls, files, gap: float = 100.0, events=None):
+        from purformat.merge import merge
+        return merge(files, gap, events)
+
+    # Asyncio versions of open and write that run in a bounded thread pool, see aio.py
+    # executor is an optional PurExecutor, by default one shared executor is used
+    @classmethod
+    async def aread(cls, file: str, lazy: bool = False, events=None, executor=None):
+        from purformat.aio import aread
+        return await aread(file, lazy, events, executor)
+
+    async def awrite(self, file, events=None, executor=None):
+        from purformat.aio import awrite
+        await awrite(self, file, events, executor)
+
+    # NumPy arrays of all image transforms for fast batch edits, see columns.py (needs NumPy)
+    def transform_arrays(self):
+        from purformat.columns import PurTransforms
+        return PurTransforms(self)
+
+    def deduplicate(self):
+        # Merge images with identical image data into one image with multiple transforms
+        # PureRef stores the image once and the extra transforms as duplicates of the first
+        # Returns how many images were removed
+        originals = {}
+        unique_images = []
+        for image in self.images:
+            if len(image.pngBinary) == 4:  # Links and duplicates are not image data
+                unique_images.append(image)
+                continue
+
+            digest = hashlib.sha256(image.pngBinary).digest()
+            if digest in originals:
+                originals[digest].transforms += image.transforms
+            else:
+                originals[digest] = image
+                unique_images.append(image)
+
+        removed = len(self.images) - len(unique_images)
+        self.images = unique_images
+        return removed
 
     def count_image_items(self):
         # Count the amount of image transforms and assign their IDs
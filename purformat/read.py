@@ -1,56 +1,39 @@
 import struct
-import colorsys
-from .items import Item, PurImage, PurGraphicsImageItem, PurGraphicsTextItem
+import mmap
+from .items import Item, PurImage, PurGraphicsImageItem
 from .purformat import PurFile
+from .events import PurEvents, default_events
+from .records import (graphics_image_item, graphics_text_item, image_item_name, text_item_name, reference_struct,
+                      png_signature, png_end, decode_image_item, decode_text_item, unpack_string as decode_string)
 
-graphics_image_item = 34
-graphics_text_item = 32
 
+# Returns where the items, folder location and references start and where the file ends, for tools that patch it
+def read_pur_file(pur_file: PurFile, filepath: str, lazy: bool = False, events: PurEvents = None):
 
-def read_pur_file(pur_file: PurFile, filepath: str):
+    events = default_events(events)
 
-    pur_bytes = bytearray(open(filepath, "rb").read())
-    read_pin = 0
+    with open(filepath, "rb") as f:
+        if lazy:  # Map the file instead of loading it, the OS only pages in what is actually accessed
+            pur_bytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            pur_file.maps.append(pur_bytes)
+        else:
+            pur_bytes = f.read()
+    # Images are sliced from here, when lazy this gives zero-copy views into the map instead of copies
+    image_bytes = memoryview(pur_bytes) if lazy else pur_bytes
+    read_pin = 0  # Offset of the next unread byte, the file is never modified
     image_items: list[PurGraphicsImageItem] = []
 
-    def erase(length):  # Remove n bytes from bytearray
-        pur_bytes[0:length] = []
+    def skip(length):  # Skip n bytes
         nonlocal read_pin
         read_pin += length
 
-    def unpack(typ: str, begin: int, stop: int):  # Bytes to type
-        return struct.unpack(typ, pur_bytes[begin:stop])[0]
-
-    def unpack_erase(typ: str):  # Unpack typ and remove from pur_bytes
-        val = unpack(typ, 0, struct.calcsize(typ))
-        erase(struct.calcsize(typ))
-        return val
-
-    def unpack_matrix():  # Unpack and delete a matrix
-        matrix = [unpack(">d", 0, 8),
-                  unpack(">d", 8, 16),
-                  unpack(">d", 24, 32),
-                  unpack(">d", 32, 40)]
-
-        erase(48)
-        return matrix
-
-    def unpack_rgb():
-        rgb = [unpack_erase(">H"),
-               unpack_erase(">H"),
-               unpack_erase(">H")]
-        return rgb
-
-    def hsv_to_rgb(hsv):
-        rgb = list(colorsys.hsv_to_rgb(hsv[0] / 35900, hsv[1] / 65535, hsv[2] / 65535))
-        rgb = [int(i * 65535) for i in rgb]
-        return rgb
+    def unpack(typ: str, begin: int, stop: int):  # Bytes to type, relative to read_pin
+        return struct.unpack_from(typ, pur_bytes, read_pin + begin)[0]
 
     def unpack_string():
-        length = unpack_erase(">I")
-        string = pur_bytes[0:length].decode("utf-16-be", errors="replace")
-        erase(length)
-        return string
+        nonlocal read_pin
+        string, read_pin = decode_string(pur_bytes, read_pin)
+        return string or ""
 
     def read_header():
         # total_text_items = unpack('>H', 12, 14) - unpack('>H', 14, 16)
@@ -67,205 +50,147 @@ def read_pur_file(pur_file: PurFile, filepath: str):
         pur_file.zoom = unpack('>d', 144, 152)
         pur_file.xCanvas, pur_file.yCanvas = unpack('>i', 216, 220), unpack('>i', 220, 224)
 
-        # Done reading header, remove and update readPin
-        erase(224)
-
-    def read_images():
-        png_head = bytearray([137, 80, 78, 71, 13, 10, 26, 10])  # PNG header
-        png_foot = bytearray([0, 0, 0, 0, 73, 69, 78, 68, 174, 66, 96, 130])  # PNG footer
+        # Done reading header, update readPin
+        skip(224)
 
-        # Read all original images, and any duplicates/links along the way
-        while pur_bytes.__contains__(png_head):
+    def items_end():  # Header file_length, where the references start, nothing before them can go past it
+        file_length = struct.unpack_from(">Q", pur_bytes, 16)[0]
+        return file_length if 224 <= file_length <= len(pur_bytes) else len(pur_bytes)
 
-            start = pur_bytes.find(png_head)
-            end = pur_bytes.find(png_foot) + 12
+    def at_items():  # Whether the item records start at read_pin, they begin with their end address and type name
+        name_length = unpack(">I", 8, 12)
+        return (name_length in (graphics_image_item, graphics_text_item) and
+                pur_bytes[read_pin + 12:read_pin + 12 + name_length] in (image_item_name, text_item_name))
 
-            if start >= 4:  # There is a duplicate before the next original image
-                image_add = PurImage()
-                image_add.address = [read_pin, 4 + read_pin]
-                image_add.pngBinary = pur_bytes[0: 4]
+    def read_images():
+        # Read all original images, and any duplicates/links along the way
+        # Every PNG is skipped by walking its chunk lengths to IEND, so the image data itself is never searched
+        # Anything else before the items is a duplicate: not an actual PNG but the 4 byte ID of the transform that
+        # does have the PNG. After transforms are put in their images by address we can merge the duplicates
+        images_end = items_end()
+        if struct.unpack_from(">H", pur_bytes, 14)[0] == 0:  # Without image items nothing refers to image data
+            images_end = read_pin
+        while read_pin + 12 <= images_end and not at_items():
+            image_add = PurImage()
+            if pur_bytes[read_pin:read_pin + 8] == png_signature:
+                end = png_end(pur_bytes, read_pin, images_end)
+                image_add.address = [read_pin, end]
+                image_add.pngBinary = image_bytes[read_pin:end]
                 pur_file.images.append(image_add)
 
-                erase(4)
+                skip(end - read_pin)
+                events.progress("images", read_pin, len(pur_bytes), images=len(pur_file.images))
             else:
-                image_add = PurImage()
-                image_add.address = [start + read_pin, end + read_pin]
-                image_add.pngBinary = pur_bytes[start: end]
+                image_add.address = [read_pin, 4 + read_pin]
+                image_add.pngBinary = pur_bytes[read_pin: read_pin + 4]
                 pur_file.images.append(image_add)
 
-                erase(end)
-
-        # Put duplicate images IDs in images too for later sorting
-        # (duplicates = totalImageItems - images.count)
-        # pngBinary here is not an actual PNG but the 4 byte ID of the transform that does have the PNG
-        # after transforms are put in their images by address we can merge the duplicates
-        while not(unpack(">I", 8, 12) == graphics_image_item or unpack(">I", 8, 12) == graphics_text_item):
-            image_add = PurImage()
-            image_add.address = [read_pin, 4 + read_pin]
-            image_add.pngBinary = pur_bytes[0: 4]
-            pur_file.images.append(image_add)
-
-            erase(4)
+                skip(4)
 
     def read_items():
-        def unpack_graphics_text_item():
-
-            transform_end = unpack(">Q", 0, 8)  # End address of either image or text transform
-
-            text_transform = PurGraphicsTextItem()
-            erase(12 + unpack(">I", 8, 12))  # Remove textItem standard text
-
-            text_transform.text = unpack_string()  # Read the text
-
-            text_transform.matrix = unpack_matrix()  # Time for matrix for scaling & rotation
-            text_transform.x = unpack_erase(">d")  # Location
-            text_transform.y = unpack_erase(">d")
-
-            erase(8)  # text unknown permanent 1.0 float we don't want
-
-            text_transform.id = unpack_erase(">I")
-            text_transform.zLayer = unpack_erase(">d")  # Z layer
-
-            # Foreground color
-            is_hsv = unpack_erase('>b') == 2  # byte indicating RGB or HSV
-            text_transform.opacity = unpack_erase(">H")  # Opacity
-            text_transform.rgb = unpack_rgb()  # RGB
-            if is_hsv:
-                text_transform.rgb = hsv_to_rgb(text_transform.rgb)
-
-            erase(2)  # Unknown 2 bytes
-
-            # Background color
-            is_background_hsv = unpack_erase(">b") == 2  # Byte indicating RGB or HSV, this is really stupid
-            text_transform.opacityBackground = unpack_erase(">H")  # BackgroundOpacity
-            text_transform.rgbBackground = unpack_rgb()  # BackgroundRGB
-            if is_background_hsv:
-                text_transform.rgbBackground = hsv_to_rgb(text_transform.rgbBackground)
-
-            number_of_children = unpack(">I", 2, 6)
-
-            erase(transform_end - read_pin)
-
-            if number_of_children > 0:
-                add_text_children(text_transform, number_of_children)
-
+        def read_text_item():
+            nonlocal read_pin
+            text_transform, number_of_children, read_pin = decode_text_item(pur_bytes, read_pin)
+            add_text_children(text_transform, number_of_children)
             return text_transform
 
-        def unpack_graphics_image_item():
-
-            transform_end = unpack(">Q", 0, 8)  # End address of either image or text transform
-
-            transform = PurGraphicsImageItem()
-            erase(12 + unpack(">I", 8, 12))  # Remove imageItem standard text
-
-            brute_force_loaded = False
-            if unpack(">I", 0, 4) == 0:  # Check if bruteforceloaded
-                brute_force_loaded = True
-                erase(4)
-                print("BruteForceLoad")
-
-            if unpack(">i", 0, 4) == -1:  # Read&Remove source
-                erase(4)
-            else:
-                transform.source = unpack_string()
-
-            if not brute_force_loaded:  # Read&Remove name
-                if unpack(">i", 0, 4) == -1:
-                    erase(4)
-                else:
-                    transform.name = unpack_string()
-
-            erase(8)  # Unknown permanent 1.0 float we don't want
-
-            transform.matrix = unpack_matrix()  # Scaling and rotation matrix
-            transform.x = unpack_erase(">d")  # Location
-            transform.y = unpack_erase(">d")
-
-            erase(8)  # Second unknown permanent 1.0 float we don't want
-
-            transform.id = unpack_erase(">I")
-            transform.zLayer = unpack_erase(">d")
-            transform.matrixBeforeCrop = unpack_matrix()  # Time for matrixBeforeCrop for scaling & rotation
-            transform.xCrop = unpack_erase(">d")  # Location before crop
-            transform.yCrop = unpack_erase(">d")
-            transform.scaleCrop = unpack_erase(">d")  # Finally crop scale
-
-            # Points of crop
-            # Why are there n+1? No idea but the first seems to be a copy of the last, maybe it's offset
-            point_count = unpack_erase(">I")
-            transform.points = [[], []]
-
-            for _ in range(point_count):
-                erase(4)
-                transform.points[0].append(unpack_erase(">d"))
-                transform.points[1].append(unpack_erase(">d"))
-
-            number_of_children = (unpack(">I", 21, 25))
-
-            erase(transform_end - read_pin)  # Remove any bytes left in the transform
-
+        def read_image_item():
+            nonlocal read_pin
+            transform, number_of_children, read_pin = decode_image_item(pur_bytes, read_pin, events)
             add_text_children(transform, number_of_children)
-
             return transform
 
         def add_text_children(parent: Item, number_of_children: int):
             for _ in range(number_of_children):
-                text = unpack_graphics_text_item()
-                parent.textChildren.append(text)
+                parent.textChildren.append(read_text_item())
 
         # Read all GraphicsImageItems and GraphicsTextItems, they are in the order they were added
-        while unpack(">I", 8, 12) == graphics_image_item or unpack(">I", 8, 12) == graphics_text_item:
-
-            if unpack(">I", 8, 12) == graphics_image_item:
-
-                image_items.append(unpack_graphics_image_item())
-
-            elif unpack(">I", 8, 12) == graphics_text_item:
-
-                pur_file.text.append(unpack_graphics_text_item())
-
+        end = items_end()
+        while read_pin + 12 <= end:
+            item_type = unpack(">I", 8, 12)
+            if item_type == graphics_image_item:
+                image_items.append(read_image_item())
+            elif item_type == graphics_text_item:
+                pur_file.text.append(read_text_item())
             else:
-                print("Error! Unknown item")  # Maybe more items will be added in the future
-                break
+                break  # The folder location follows the last item
+
+    def read_references():
+        # After the final item, the header file_length is reached. This marks the beginning of the location and refs
+        pur_file.folderLocation = unpack_string()
+        sections["references"] = read_pin
+
+        # From now on the rest of the file is just a list coupling transform IDs (GraphicsImageItem)
+        # with the address of the image (PurImage) it uses. Duplicate images are included and are removed later.
+        items_by_id = {item.id: item for item in image_items}
+        images_by_address = {image.address[0]: image for image in pur_file.images}
+        for _ in range(len(image_items)):
+            ref_id, ref_start, ref_end = reference_struct.unpack_from(pur_bytes, read_pin)
+            item = items_by_id.get(ref_id)
+            image = images_by_address.get(ref_start)
+            if item is None or image is None:
+                events.message("Error! Reference to unknown transform " + str(ref_id) + " or address " + str(ref_start))
+            else:
+                image.transforms = [item]
+
+            skip(20)
+
+        # Image is duplicate if it has 4 bytes (transform.id) but it is not all 0xFF meaning an image link
+        def is_duplicate(img):
+            return len(img.pngBinary) == 4 and img.pngBinary != b'\xFF\xFF\xFF\xFF'
+
+        # Remove all duplicate images, and add their transform to the original image.
+        # Duplicate images only have 4 bytes of pngBinary, which is actually the transform.id of the original image
+        # We need to determine if pngBinary of an image is 4 bytes (meaning it's not image data but a transform ID,
+        # and if it is, remove it and add its transform to the original image
+        images_by_transform_id = {image.transforms[0].id: image for image in pur_file.images
+                                  if image.transforms and not is_duplicate(image)}
+        for image in pur_file.images:  # Remove duplicate images and add their transform to the original image
+            if is_duplicate(image):
+                original = images_by_transform_id.get(struct.unpack('>I', image.pngBinary)[0])
+                if original is None:
+                    events.message("Error! Duplicate of unknown transform " +
+                                   str(struct.unpack('>I', image.pngBinary)[0]))
+                else:
+                    original.transforms += image.transforms
+        # duplicates get removed, but links stay
+        pur_file.images = [image for image in pur_file.images if not is_duplicate(image)]
+
+        # An image no reference points to can't be placed on the canvas, and can't be written back without a transform
+        orphaned = sum(not image.transforms for image in pur_file.images)
+        if orphaned:
+            events.message("Error! Removed " + str(orphaned) + " images that no transform refers to")
+            pur_file.images = [image for image in pur_file.images if image.transforms]
 
     ################################################################################################################
     # Read the PureRef file
     ################################################################################################################
 
-    read_header()  # Read header info, set total_image_items and PurFile.canvas
-
-    read_images()  # Read all PNG image data, and duplicates (which are the transform.id from another image)
-
-    read_items()  # Read all the items, and add them to the image_items list
-
-    # After the final item, the header file_length is reached. This marks the beginning of the location and refs
-    pur_file.folderLocation = unpack_string()
-
-    # From now on the rest of the file is just a list coupling transform IDs (GraphicsImageItem)
-    # with the address of the image (PurImage) it uses. Duplicate images are included and are removed later.
-    for _ in range(len(image_items)):
-        red_id = unpack(">I", 0, 4)
-        ref_address = [unpack(">Q", 4, 12), unpack(">Q", 12, 20)]
-        for item in image_items:
-            if red_id == item.id:
-                for image in pur_file.images:
-                    if ref_address[0] == image.address[0]:
-                        image.transforms = [item]
-
-        erase(20)
-
-    # Image is duplicate if it has 4 bytes (transform.id) but it is not all 0xFF meaning an image link
-    def is_duplicate(img):
-        return len(img.pngBinary) == 4 and img.pngBinary != b'\xFF\xFF\xFF\xFF'
-
-    # Remove all duplicate images, and add their transform to the original image.
-    # Duplicate images only have 4 bytes of pngBinary, which is actually the transform.id of the original image
-    # We need to determine if pngBinary of an image is 4 bytes (meaning it's not image data but a transform ID,
-    # and if it is, remove it and add its transform to the original image
-    for image in pur_file.images:  # Remove duplicate images and add their transform to the original image
-        if is_duplicate(image):
-            for other_image in pur_file.images:
-                if struct.unpack('>I', image.pngBinary)[0] == other_image.transforms[0].id:
-                    other_image.transforms += image.transforms
-    # duplicates get removed, but links stay
-    pur_file.images = [image for image in pur_file.images if not is_duplicate(image)]
+    sections = {}  # Where each part of the file starts
+
+    with events.phase("header") as counts:
+        read_header()  # Read header info, set total_image_items and PurFile.canvas
+        counts["fileBytes"] = len(pur_bytes)
+
+    with events.phase("images") as counts:
+        read_images()  # Read all PNG image data, and duplicates (which are the transform.id from another image)
+        counts["images"] = len(pur_file.images)
+        counts["bytes"] = read_pin - 224
+
+    with events.phase("items") as counts:
+        start = sections["items"] = read_pin
+        read_items()  # Read all the items, and add them to the image_items list
+        counts["imageItems"] = len(image_items)
+        counts["textItems"] = len(pur_file.text)
+        counts["bytes"] = read_pin - start
+
+    with events.phase("references") as counts:
+        sections["folderLocation"] = read_pin
+        read_references()
+        counts["references"] = len(image_items)
+        counts["images"] = len(pur_file.images)
+    sections["end"] = len(pur_bytes)
+
+    # The nested readers reference each other, so without this the file would stay in memory until garbage collection
+    pur_bytes = image_bytes = None
+    return sections
@@ -0,0 +1,277 @@
+import struct
+import colorsys
+from itertools import chain
+from .items import PurGraphicsImageItem, PurGraphicsTextItem
+from .events import PurEvents
+
+########################################################################################################################
+# Layout of the GraphicsImageItem and GraphicsTextItem records, shared by read.py and write.py
+# Every fixed size run of fields is described once as a Record, which is compiled into a single struct.Struct
+# and decodes or encodes the whole run in one call. Only strings and crop points have a variable length.
+########################################################################################################################
+
+image_item_name = "GraphicsImageItem".encode("utf-16-be")
+text_item_name = "GraphicsTextItem".encode("utf-16-be")
+# Records are recognized by the byte length of their type name, which follows the 8 byte end address
+graphics_image_item = len(image_item_name)  # 34
+graphics_text_item = len(text_item_name)  # 32
+
+item_header_struct = struct.Struct(">QI")  # End address of the record and length of the type name
+string_length_struct = struct.Struct(">i")  # -1 for a null string
+crop_point_struct = struct.Struct(">Idd")  # 0 for the first point and 1 for the rest, x, y
+reference_struct = struct.Struct(">IQQ")  # transform ID, image start and end address
+
+png_signature = b"\x89PNG\r\n\x1a\n"
+png_chunk_struct = struct.Struct(">I4s")  # Length of the chunk data and the chunk type, the data and a CRC follow
+
+
+class Field:
+    # A single value of format stored in the item attribute name
+    def __init__(self, name: str, format: str):
+        self.name = name
+        self.format = format
+
+    def encode(self, item):
+        return (getattr(item, self.name),)
+
+    def decode(self, item, values, extra: dict):
+        setattr(item, self.name, values[0])
+
+
+class Constant(Field):
+    # A value that is always written the same, and ignored when reading
+    def __init__(self, format: str, value):
+        super().__init__("", format)
+        self.value = value
+
+    def encode(self, item):
+        return (self.value,)
+
+    def decode(self, item, values, extra: dict):
+        pass
+
+
+class Count(Field):
+    # Number of entries of a list attribute, the entries follow the record and are read by the caller
+    def __init__(self, name: str, format: str = "I"):
+        super().__init__(name, format)
+
+    def encode(self, item):
+        return (len(getattr(item, self.name)),)
+
+    def decode(self, item, values, extra: dict):
+        extra[self.name] = values[0]
+
+
+class Matrix(Field):
+    # 2x3 matrix of doubles, the third column is always 0.0 so only m11, m12, m21, m22 are kept
+    def __init__(self, name: str):
+        super().__init__(name, "6d")
+
+    def encode(self, item):
+        m = getattr(item, self.name)
+        return m[0], m[1], 0.0, m[2], m[3], 0.0
+
+    def decode(self, item, values, extra: dict):
+        setattr(item, self.name, (values[0], values[1], values[3], values[4]))
+
+
+class Color(Field):
+    # A byte that is 2 for HSV and 1 for RGB, opacity and three channels, always written as RGB
+    def __init__(self, opacity: str, rgb: str):
+        super().__init__(rgb, "bH3H")
+        self.opacity = opacity
+
+    def encode(self, item):
+        rgb = getattr(item, self.name)
+        return (1, getattr(item, self.opacity)) + tuple(rgb)
+
+    def decode(self, item, values, extra: dict):
+        setattr(item, self.opacity, values[1])
+        if values[0] == 2:
+            rgb = colorsys.hsv_to_rgb(values[2] / 35900, values[3] / 65535, values[4] / 65535)
+            setattr(item, self.name, [int(i * 65535) for i in rgb])
+        else:
+            setattr(item, self.name, values[2:5])
+
+
+class Record:
+    # A fixed size run of fields, compiled into one struct.Struct
+    def __init__(self, *fields: Field):
+        self.fields = fields
+        self.struct = struct.Struct(">" + "".join(field.format for field in fields))
+        self.size = self.struct.size
+
+        # Where the values of each field start in the unpacked tuple. Plain fields are set in one tight loop,
+        # constants are skipped and only the others need their own decode
+        self.plain, self.special = [], []
+        start = 0
+        for field in fields:
+            stop = start + len(struct.unpack(">" + field.format, bytes(struct.calcsize(">" + field.format))))
+            if type(field) is Field:
+                self.plain.append((field.name, start))
+            elif not isinstance(field, Constant):
+                self.special.append((field, start, stop))
+            start = stop
+
+    def pack(self, item):
+        return self.struct.pack(*chain.from_iterable(field.encode(item) for field in self.fields))
+
+    # Set the fields of item from the bytes at offset, returns the values of Count fields by name
+    def unpack_from(self, item, buffer, offset: int):
+        values = self.struct.unpack_from(buffer, offset)
+        for name, index in self.plain:
+            setattr(item, name, values[index])
+        extra = {}
+        for field, start, stop in self.special:
+            field.decode(item, values[start:stop], extra)
+        return extra
+
+
+# GraphicsImageItem, after the header, the source and the name
+image_item_record = Record(
+    Constant("d", 1.0),  # Mysterious 1.0 double
+    Matrix("matrix"),  # Scaling and rotation
+    Field("x", "d"), Field("y", "d"),  # Location
+    Constant("d", 1.0),  # Second mysterious 1.0 double
+    Field("id", "I"),
+    Field("zLayer", "d"),
+    Matrix("matrixBeforeCrop"),
+    Field("xCrop", "d"), Field("yCrop", "d"),  # Location before crop
+    Field("scaleCrop", "d"),
+)
+
+# GraphicsImageItem, after the crop points
+image_item_tail_record = Record(
+    Constant("d", 0.0),  # Always the same, no idea if this actually holds information
+    Constant("I", 1),
+    Constant("b", 0),
+    Constant("q", -1),
+    Count("textChildren"),
+)
+
+# GraphicsTextItem, after the header and the text
+text_item_record = Record(
+    Matrix("matrix"),
+    Field("x", "d"), Field("y", "d"),  # Location
+    Constant("d", 1.0),  # Mysterious 1.0 double
+    Field("id", "I"),
+    Field("zLayer", "d"),
+    Color("opacity", "rgb"),  # Foreground
+    Constant("H", 0),  # Mysterious value that counts something about the background
+    Color("opacityBackground", "rgbBackground"),
+    Constant("H", 0),
+    Count("textChildren"),
+)
+
+
+# End of the PNG at offset, found by walking its chunks from the signature to IEND without searching the data
+# Raises ValueError if there is no PNG at offset or its chunks don't add up before limit
+def png_end(buffer, offset: int, limit: int = None):
+    limit = len(buffer) if limit is None else limit
+    if buffer[offset:offset + 8] != png_signature:
+        raise ValueError(f"No PNG signature at {offset}")
+    position = offset + 8
+    while position + 12 <= limit:
+        length, chunk_type = png_chunk_struct.unpack_from(buffer, position)
+        if length > 0x7FFFFFFF or not chunk_type.isalpha():
+            raise ValueError(f"Broken PNG at {offset}: invalid chunk at {position}")
+        position += 12 + length
+        if chunk_type == b"IEND":
+            if position > limit:
+                break
+            return position
+    raise ValueError(f"Broken PNG at {offset}: no IEND chunk before {limit}")
+
+
+def pack_string(string: str):
+    encoded = string.encode("utf-16-be")
+    return string_length_struct.pack(len(encoded)) + encoded
+
+
+# Returns the string at offset (None if it is a null string) and the offset after it
+def unpack_string(buffer, offset: int):
+    length = string_length_struct.unpack_from(buffer, offset)[0]
+    offset += 4
+    if length == -1:
+        return None, offset
+    return bytes(buffer[offset:offset + length]).decode("utf-16-be", errors="replace"), offset + length
+
+
+# Encode a transform starting at address, without its text children which follow it
+def encode_image_item(transform: PurGraphicsImageItem, address: int):
+    brute_force_loaded = transform.source == "BruteForceLoaded"
+    record = bytearray(item_header_struct.pack(0, graphics_image_item))
+    record += image_item_name
+    if brute_force_loaded:  # Is bruteforceloaded there is an extra empty 4 bytes, and no name
+        record += b"\x00\x00\x00\x00"
+    record += pack_string(transform.source)
+    # PureRef can have empty names, but we have brute_force_loaded as default
+    if not brute_force_loaded:
+        record += pack_string(transform.name)
+
+    record += image_item_record.pack(transform)
+
+    # Number of crop points, the first point is marked with 0
+    x_points, y_points = transform.points
+    record += struct.pack(">I", len(x_points))
+    for i in range(len(x_points)):
+        record += crop_point_struct.pack(0 if i == 0 else 1, x_points[i], y_points[i])
+
+    record += image_item_tail_record.pack(transform)
+    record[0:8] = struct.pack(">Q", address + len(record))  # Start of transform needs its own end address
+    return record
+
+
+# Decode the GraphicsImageItem at offset, returns it with its number of text children and the end of the record
+def decode_image_item(buffer, offset: int, events: PurEvents):
+    transform_end, name_length = item_header_struct.unpack_from(buffer, offset)
+    offset += 12 + name_length  # Skip imageItem standard text
+    transform = PurGraphicsImageItem()
+
+    brute_force_loaded = struct.unpack_from(">I", buffer, offset)[0] == 0
+    if brute_force_loaded:
+        offset += 4
+        events.message("BruteForceLoad")
+
+    source, offset = unpack_string(buffer, offset)
+    if source is not None:
+        transform.source = source
+    if not brute_force_loaded:
+        name, offset = unpack_string(buffer, offset)
+        if name is not None:
+            transform.name = name
+
+    image_item_record.unpack_from(transform, buffer, offset)
+    offset += image_item_record.size
+
+    # Points of crop
+    # Why are there n+1? No idea but the first seems to be a copy of the last, maybe it's offset
+    point_count = struct.unpack_from(">I", buffer, offset)[0]
+    offset += 4
+    points = [crop_point_struct.unpack_from(buffer, offset + i * crop_point_struct.size) for i in range(point_count)]
+    transform.points = [[point[1] for point in points], [point[2] for point in points]]
+    offset += point_count * crop_point_struct.size
+
+    children = image_item_tail_record.unpack_from(transform, buffer, offset)["textChildren"]
+    return transform, children, transform_end
+
+
+def encode_text_item(text_transform: PurGraphicsTextItem, address: int):
+    record = bytearray(item_header_struct.pack(0, graphics_text_item))
+    record += text_item_name
+    record += pack_string(text_transform.text)
+    record += text_item_record.pack(text_transform)
+    record[0:8] = struct.pack(">Q", address + len(record))
+    return record
+
+
+def decode_text_item(buffer, offset: int):
+    transform_end, name_length = item_header_struct.unpack_from(buffer, offset)
+    offset += 12 + name_length  # Skip textItem standard text
+    text_transform = PurGraphicsTextItem()
+
+    text, offset = unpack_string(buffer, offset)
+    text_transform.text = text or ""
+    children = text_item_record.unpack_from(text_transform, buffer, offset)["textChildren"]
+    return text_transform, children, transform_end
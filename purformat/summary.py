@@ -0,0 +1,69 @@
+import os
+from typing import List
+from .items import PurGraphicsTextItem
+from .purformat import PurFile
+from .events import PurEvents
+
+
+class PurSummary:
+    # Metadata of a .pur file without any of its image data, made by scan()
+    def __init__(self):
+        self.path = ""
+        self.fileSize = 0  # bytes
+        self.canvas = [-10000.0, -10000.0, 10000.0, 10000.0]
+        self.zoom = 1.0
+        self.xCanvas, self.yCanvas = 0, 0
+        self.folderLocation = ""
+        self.imageSizes: List[int] = []  # PNG bytes per image
+        self.imageItems: List[List[str]] = []  # [name, source] per image transform
+        self.textItems: List[str] = []  # text of every text item, children included
+
+    @property
+    def imageCount(self):
+        return len(self.imageSizes)
+
+    @property
+    def imageBytes(self):
+        return sum(self.imageSizes)
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "fileSize": self.fileSize,
+            "canvas": self.canvas,
+            "zoom": self.zoom,
+            "xCanvas": self.xCanvas,
+            "yCanvas": self.yCanvas,
+            "folderLocation": self.folderLocation,
+            "imageCount": self.imageCount,
+            "imageBytes": self.imageBytes,
+            "imageSizes": self.imageSizes,
+            "imageItems": self.imageItems,
+            "textItems": self.textItems,
+        }
+
+
+# Summarize a .pur file, the file is memory-mapped and image data is skipped over without being copied
+# Nothing is printed unless events are given, so the summary can be used as machine-readable output
+def scan(filepath: str, events: PurEvents = None):
+    with PurFile.open(filepath, lazy=True, events=PurEvents() if events is None else events) as pur_file:
+        summary = PurSummary()
+        summary.path = filepath
+        summary.fileSize = os.path.getsize(filepath)
+        summary.canvas = pur_file.canvas
+        summary.zoom = pur_file.zoom
+        summary.xCanvas, summary.yCanvas = pur_file.xCanvas, pur_file.yCanvas
+        summary.folderLocation = pur_file.folderLocation
+
+        def add_text(text_item: PurGraphicsTextItem):
+            summary.textItems.append(text_item.text)
+            list(map(add_text, text_item.textChildren))
+
+        for image in pur_file.images:
+            summary.imageSizes.append(len(image.pngBinary))
+            for transform in image.transforms:
+                summary.imageItems.append([transform.name, transform.source])
+                list(map(add_text, transform.textChildren))
+        list(map(add_text, pur_file.text))
+
+    return summary
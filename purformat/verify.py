@@ -0,0 +1,135 @@
+import os
+import mmap
+import struct
+import hashlib
+from typing import List, Union
+from .records import graphics_image_item, graphics_text_item, item_header_struct, reference_struct, png_end
+
+########################################################################################################################
+# Check a .pur file without reading it into memory: the checksum is hashed in chunks and the structure is walked in a
+# memory map, through the header, the reference table, every PNG and every item record.
+########################################################################################################################
+
+hash_chunk_size = 1024 * 1024
+
+
+class PurVerification:
+    # Result of verify(), the file is fine if there are no errors
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.fileSize = 0  # bytes
+        self.checksum = ""  # stored in the header
+        self.computedChecksum = ""  # MD5 of everything from byte 108
+        self.images = 0  # PNGs in the file
+        self.imageItems = 0  # image item records
+        self.errors: List[str] = []
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "ok": self.ok,
+            "fileSize": self.fileSize,
+            "checksum": self.checksum,
+            "computedChecksum": self.computedChecksum,
+            "images": self.images,
+            "imageItems": self.imageItems,
+            "errors": self.errors,
+        }
+
+
+def verify_checksum(f, result: PurVerification):
+    md5 = hashlib.md5()
+    f.seek(108)
+    for chunk in iter(lambda: f.read(hash_chunk_size), b""):
+        md5.update(chunk)
+    result.computedChecksum = md5.hexdigest()
+    if result.computedChecksum != result.checksum:
+        result.errors.append(f"Checksum {result.checksum!r} in the header, but the file hashes to "
+                             f"{result.computedChecksum!r}")
+
+
+def verify_structure(data, result: PurVerification):
+    errors = result.errors
+    size = len(data)
+    if struct.unpack_from(">I", data, 0)[0] != 8:
+        errors.append("Not a PureRef file, the first 4 bytes should be 8")
+        return
+
+    # The header file length is where the reference table starts, it has one entry per image item
+    image_items = struct.unpack_from(">H", data, 14)[0]
+    file_length = struct.unpack_from(">Q", data, 16)[0]
+    if not 224 <= file_length <= size:
+        errors.append(f"Header file length {file_length} is outside the file of {size} bytes")
+        return
+    if (size - file_length) % reference_struct.size or (size - file_length) // reference_struct.size != image_items:
+        errors.append(f"Reference table of {size - file_length} bytes after {file_length} "
+                      f"does not hold the {image_items} image items of the header")
+        return
+
+    # Every reference points at a PNG or at a 4 byte duplicate or link, together they fill the image data
+    ranges = set()
+    for offset in range(file_length, size, reference_struct.size):
+        transform_id, start, end = reference_struct.unpack_from(data, offset)
+        if not 224 <= start < end <= file_length:
+            errors.append(f"Reference of transform {transform_id} to {start}-{end} is out of bounds")
+        elif end - start != 4:
+            try:
+                png_stop = png_end(data, start, end)
+                if png_stop != end:
+                    errors.append(f"PNG at {start} ends at {png_stop}, but transform {transform_id} says {end}")
+            except ValueError as error:
+                errors.append(str(error))
+        ranges.add((start, end))
+
+    items_start = 224
+    for start, end in sorted(ranges):
+        if start < items_start:
+            errors.append(f"Image data at {start}-{end} overlaps the image data before it")
+        elif start > items_start:
+            errors.append(f"No reference to the bytes at {items_start}-{start}")
+        items_start = max(items_start, end)
+        result.images += end - start != 4
+
+    # Walk the item records, every record holds its own end address, the folder location ends at file_length
+    position = items_start
+    while position + 12 <= file_length:
+        end, name_length = item_header_struct.unpack_from(data, position)
+        if name_length not in (graphics_image_item, graphics_text_item):
+            break
+        if not position + 12 + name_length < end <= file_length:
+            errors.append(f"Item at {position} ends at {end}, outside of the items")
+            return
+        result.imageItems += name_length == graphics_image_item
+        position = end
+
+    if position + 4 > file_length:
+        errors.append(f"The items run into the references at {file_length}")
+        return
+    location_length = struct.unpack_from(">i", data, position)[0]
+    location_end = position + 4 + max(location_length, 0)
+    if location_end != file_length:
+        errors.append(f"Unknown data at {position}-{file_length} after the items")
+    if result.imageItems != image_items:
+        errors.append(f"Header counts {image_items} image items, but there are {result.imageItems}")
+
+
+# Check the checksum and structure of the .pur file at path, every problem found is in the errors of the result
+def verify(path: Union[str, os.PathLike]):
+    result = PurVerification(str(path))
+    try:
+        result.fileSize = os.path.getsize(path)
+        with open(path, "rb") as f:
+            if result.fileSize < 224:
+                result.errors.append(f"File of {result.fileSize} bytes is smaller than the 224 byte header")
+                return result
+            result.checksum = f.read(108)[44:108].decode("utf-16-be", errors="replace")
+            verify_checksum(f, result)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                verify_structure(data, result)
+    except OSError as error:
+        result.errors.append(str(error))
+    return result
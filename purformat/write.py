@@ -1,33 +1,91 @@
 import struct
+import os
+import time
+import shutil
+from contextlib import contextmanager
+from typing import BinaryIO, Union
 from .items import PurGraphicsImageItem, PurGraphicsTextItem
 from .purformat import PurFile
+from .events import PurEvents, default_events
+from .records import reference_struct, encode_image_item, encode_text_item, pack_string
 import hashlib
 
 
-def write_pur_file(pur_file: PurFile, filepath: str):
+# Open a new file next to filepath that replaces it when the with block ends, and is removed if the block fails
+# Symlinks are followed so the file they point to is replaced, an existing file keeps its permissions
+@contextmanager
+def replacing(filepath: Union[str, os.PathLike]):
+    target = os.path.realpath(filepath)
+    while True:  # A name of its own, so an unrelated file is never overwritten
+        temp_path = target + "." + os.urandom(4).hex() + ".tmp"
+        try:
+            f = open(temp_path, "xb")
+            break
+        except FileExistsError:
+            pass
+    try:
+        with f:
+            yield f
+        if os.path.exists(target):
+            shutil.copymode(target, temp_path)
+        os.replace(temp_path, target)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def write_pur_file(pur_file: PurFile, filepath: Union[str, os.PathLike, BinaryIO], events: PurEvents = None):
+
+    if isinstance(filepath, (str, os.PathLike)):
+        # Write next to the target and swap it in when done, so a failed write leaves the target as it was
+        # On Linux and macOS a lazily read PurFile can be saved over its own file this way, Windows can't replace a
+        # file that is still mapped, so there it has to be read without lazy first
+        with replacing(filepath) as f:
+            write_pur_stream(pur_file, f, events)
+    else:
+        write_pur_stream(pur_file, filepath, events)
+
+
+def write_pur_stream(pur_file: PurFile, f: BinaryIO, events: PurEvents = None):
+    # Streams the file to a seekable binary file object, only one item is held in memory at a time
+    # Images are written straight through, the checksum is hashed along the way and patched in at the end
+
+    events = default_events(events)
+    hash_seconds = 0.0  # Time spent on the checksum, which is spread over all other phases
+
+    origin = f.tell()  # Addresses in the file are relative to where it starts
+    flushed = 0  # Bytes already written to f
+    pur_bytes = bytearray()  # Buffer for the record that is currently being written
+    md5 = hashlib.md5()  # Checksum of everything from byte 108 onwards
+
+    def write_pin():  # Address of the next byte that will be written
+        return flushed + len(pur_bytes)
+
+    def hash_update(data):
+        nonlocal hash_seconds
+        start = time.perf_counter()
+        md5.update(data)
+        hash_seconds += time.perf_counter() - start
+
+    def flush():  # Write the buffer to the file
+        nonlocal flushed
+        f.write(pur_bytes)
+        hash_update(pur_bytes)
+        flushed += len(pur_bytes)
+        pur_bytes.clear()
 
-    pur_bytes = bytearray()
+    def write_direct(data):  # Write data to the file without copying it into the buffer
+        nonlocal flushed
+        flush()
+        f.write(data)
+        hash_update(data)
+        flushed += len(data)
 
     def pack_add(typ: str, *args):
         pur_bytes.extend(struct.pack(typ, *args))
 
-    def pack_add_matrix(matrix: []):
-        pack_add(">d", matrix[0])
-        pack_add(">d", matrix[1])
-        pack_add(">d", 0.0)
-        pack_add(">d", matrix[2])
-        pack_add(">d", matrix[3])
-        pack_add(">d", 0.0)
-
-    def pack_add_rgb(rgb: []):
-        for value in rgb:
-            pur_bytes.extend(struct.pack(">H", value))
-
-    def pack_add_string(string: str):
-        pack_add(">I", len(string.encode("utf-16-be")))
-        pur_bytes.extend(string.encode("utf-16-be"))
-
     def write_header():
+        nonlocal flushed
         pur_bytes[:] = bytearray(b'\x00') * 224  # 224 empty bytes to fill the header with
         pur_bytes[0:4] = struct.pack(">I", 8)  # Needed to recognize the file as a PureRef file
         pur_bytes[4:12] = "1.10".encode("utf-16-be")  # Version, 1.11.1 still uses 1.10 format
@@ -35,6 +93,8 @@ def write_pur_file(pur_file: PurFile, filepath: str):
         # Write GraphicsImageItem+GraphicsTextItem count and GraphicsImageItem count
         image_items = pur_file.count_image_items()  # Assign IDs to image items
         text_items = pur_file.count_text_items(image_items)  # Assign IDs to text items
+        if image_items + text_items > 65535:
+            raise ValueError(f"A .pur file holds at most 65535 items, this one has {image_items + text_items}")
         pur_bytes[12:14] = struct.pack(">H", image_items + text_items)
         pur_bytes[14:16] = struct.pack(">H", image_items)
 
@@ -59,113 +119,32 @@ def write_pur_file(pur_file: PurFile, filepath: str):
 
         pur_bytes[216:224] = struct.pack(">i", pur_file.xCanvas) + struct.pack(">i", pur_file.yCanvas)  # View X Y
 
+        # File length and checksum are patched in at the end, only the bytes after the checksum are hashed
+        f.write(pur_bytes[:108])
+        flushed += 108
+        del pur_bytes[:108]
+        flush()
+
     def write_images():
 
-        for image_add in pur_file.images:
-            image_add.address[0] = len(pur_bytes)
-            pur_bytes.extend(image_add.pngBinary)
-            image_add.address[1] = len(pur_bytes)
+        for done, image_add in enumerate(pur_file.images):
+            events.progress("images", done, len(pur_file.images))
+            if not image_add.transforms:  # Nothing would refer to it, so PureRef would never show it
+                continue
+            image_add.address[0] = write_pin()
+            write_direct(image_add.pngBinary)
+            image_add.address[1] = write_pin()
             # go through all transforms and pack_add(">I", parent.id)) except the first one which is the parent
             parent = image_add.transforms[0]
             [pack_add(">I", parent.id) for _ in image_add.transforms[1:]]
 
     def write_text(text_transform: PurGraphicsTextItem):
-        transform_end = len(pur_bytes)
-        pur_bytes.extend(struct.pack(">Q", 0))
-
-        pur_bytes[transform_end:transform_end + 8] = struct.pack(">Q", len(pur_bytes))
-        pack_add(">I", 32)
-        pur_bytes.extend("GraphicsTextItem".encode("utf-16-be"))
-
-        pack_add_string(text_transform.text)  # The text
-
-        pack_add_matrix(text_transform.matrix)  # Matrix
-        pack_add(">d", text_transform.x)  # Location
-        pack_add(">d", text_transform.y)
-
-        pack_add(">d", 1.0)  # Mysterious 1.0 double
-
-        pack_add(">I", text_transform.id)  # ID
-        pack_add(">d", text_transform.zLayer)  # Zlayer
-
-        pack_add(">b", 1)  # Weird meaningless byte
-
-        # Foreground color
-        pack_add(">H", text_transform.opacity)  # Opacity
-        pack_add_rgb(text_transform.rgb)  # RGB
-
-        pack_add(">H", 0)  # Mysterious values that counts something about background
-        pack_add(">b", 1)
-
-        # Background color
-        pack_add(">H", text_transform.opacityBackground)  # Opacity
-        pack_add_rgb(text_transform.rgbBackground)  # RGB
-
-        pack_add(">H", 0)
-        pack_add(">I", len(text_transform.textChildren))  # how many text children
-
-        # Start of transform needs its own end address
-        pur_bytes[transform_end:transform_end + 8] = struct.pack(">Q", len(pur_bytes))
-
-        # Write text children
-        list(map(write_text, text_transform.textChildren))
+        pur_bytes.extend(encode_text_item(text_transform, write_pin()))
+        list(map(write_text, text_transform.textChildren))  # Write text children
 
     def write_image(transform: PurGraphicsImageItem):
-
-        # transform_end prints current writePin for now to replace later
-        transform_end = len(pur_bytes)
-        pack_add(">Q", 0)
-        # Purimageitem text
-        brute_force_loaded = transform.source == "BruteForceLoaded"
-        pack_add(">I", 34)
-        pur_bytes.extend("GraphicsImageItem".encode("utf-16-be"))
-        # Is bruteforceloaded there is an extra empty 8 byte
-        if brute_force_loaded:
-            pack_add(">I", 0)
-        # Source
-        pack_add_string(transform.source)
-        # Name (skipped if bruteforceloaded)
-        # PureRef can have empty names, but we have brute_force_loaded as default
-        if not brute_force_loaded:
-            pack_add_string(transform.name)
-
-        pack_add(">d", 1.0)  # Mysterious 1.0 double
-
-        pack_add_matrix(transform.matrix)  # Scaling matrix
-        pack_add(">d", transform.x)  # Location
-        pack_add(">d", transform.y)
-
-        pack_add(">d", 1.0)  # Mysterious 1.0 double
-
-        pack_add(">I", transform.id)  # ID and ZLayer
-        pack_add(">d", transform.zLayer)
-        pack_add_matrix(transform.matrixBeforeCrop)  # MatrixBeforeCrop
-        pack_add(">d", transform.xCrop)  # Location before crop
-        pack_add(">d", transform.yCrop)
-        pack_add(">d", transform.scaleCrop)  # Finally crop scale
-
-        # Number of crop points
-        pack_add(">I", len(transform.points[0]))
-        for i in range(len(transform.points[0])):
-            if i == 0:
-                pack_add(">I", 0)
-            else:
-                pack_add(">I", 1)
-            pack_add(">d", transform.points[0][i])
-            pack_add(">d", transform.points[1][i])
-
-        # Always the same, no idea if this actually holds information
-        pack_add(">d", 0.0)
-        pack_add(">I", 1)
-        pack_add(">b", 0)
-        pack_add(">q", -1)
-        pack_add(">I", len(transform.textChildren))  # how many text children
-
-        # Start of transform needs its own end address
-        pur_bytes[transform_end:transform_end + 8] = struct.pack(">Q", len(pur_bytes))
-
-        # Write text children
-        list(map(write_text, transform.textChildren))
+        pur_bytes.extend(encode_image_item(transform, write_pin()))
+        list(map(write_text, transform.textChildren))  # Write text children
 
     def write_items():
 
@@ -173,11 +152,14 @@ def write_pur_file(pur_file: PurFile, filepath: str):
             # list of all transforms from all images
             transforms = [transform for image in pur_file.images for transform in image.transforms]
 
-            list(map(write_image, transforms))
+            for transform in transforms:
+                write_image(transform)
+                flush()
 
         # Time for unparented text
         for textTransform in pur_file.text:
             write_text(textTransform)
+            flush()
 
     def write_references():
         # Write references which couple image addresses to transform IDs
@@ -185,33 +167,49 @@ def write_pur_file(pur_file: PurFile, filepath: str):
         for image in pur_file.images:
             for i, transform in enumerate(image.transforms):
                 if i == 0:
-                    pack_add(">I", transform.id)
-                    pack_add(">Q", image.address[0])
-                    pack_add(">Q", image.address[1])
+                    pur_bytes.extend(reference_struct.pack(transform.id, image.address[0], image.address[1]))
                 else:
                     offset = (i - 1) * 4
-                    pack_add(">I", transform.id)
-                    pack_add(">Q", image.address[1] + offset)
-                    pack_add(">Q", image.address[1] + offset + 4)
+                    pur_bytes.extend(reference_struct.pack(transform.id, image.address[1] + offset,
+                                                           image.address[1] + offset + 4))
 
     ################################################################################################################
     # Write the PureRef file
     ################################################################################################################
 
-    write_header()  # Write header
+    with events.phase("header"):
+        write_header()  # Write header
+
+    with events.phase("images") as counts:
+        write_images()  # Write images, saving addresses and references, and write duplicate images
+        counts["images"] = len(pur_file.images)
+        counts["bytes"] = write_pin() - 224
 
-    write_images()  # Write images, saving addresses and references, and write duplicate images
+    with events.phase("items") as counts:
+        start = write_pin()
+        write_items()  # Write image and text items, in the right order
+        counts["imageItems"] = sum(len(image.transforms) for image in pur_file.images)
+        counts["textItems"] = len(pur_file.text)
+        counts["bytes"] = write_pin() - start
 
-    write_items()  # Write image and text items, in the right order
+    with events.phase("references") as counts:
+        pur_bytes.extend(pack_string(pur_file.folderLocation))  # Length location
+        file_length = write_pin()  # Header file_length, which is where refs begin
 
-    pack_add_string(pur_file.folderLocation)  # Length location
-    pur_bytes[16:24] = struct.pack(">Q", len(pur_bytes))  # Update header file_length, which is where refs begin
+        write_references()  # Write references
+        flush()
+        counts["fileBytes"] = flushed
 
-    write_references()  # Write references
+    f.seek(origin + 16)  # Update header file_length
+    f.write(struct.pack(">Q", file_length))
 
     # this is the checksum, it's crazy that I figured this out
     # on bytes 2C to 6C write Md5 hash of the rest of the file
-    pur_bytes[44:108] = hashlib.md5(pur_bytes[108:]).hexdigest().encode("utf-16-be")
+    f.seek(origin + 44)
+    f.write(md5.hexdigest().encode("utf-16-be"))
 
-    with open(filepath, "wb") as f:
-        f.write(pur_bytes)
+    f.seek(origin + flushed)
+
+    # Hashing happens while writing, so this time is also part of the phases above
+    events.timings["checksum"] = events.timings.get("checksum", 0.0) + hash_seconds
+    events.emit("phase", phase="checksum", seconds=hash_seconds, bytes=flushed - 108)